@@ -19,4 +19,5 @@
 #
 ##############################################################################
 
+import controllers
 import models
@@ -35,9 +35,11 @@ Suggestions & Feedback to: corentin.pouhet-brunerie@smile.fr
     """,
     "depends": [
         'base',
+        'smile_base',
     ],
     "data": [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/audit_rule_view.xml',
         'views/audit_log_view.xml',
     ],
@@ -0,0 +1,34 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import json
+
+from odoo import http
+from odoo.http import request
+
+
+class AuditController(http.Controller):
+
+    @http.route('/audit/stats', type='http', auth='user', methods=['GET'])
+    def stats(self, **kw):
+        """ Return audit rules statistics in JSON, for monitoring purpose """
+        stats = request.env['audit.rule'].get_stats()
+        return request.make_response(json.dumps(stats), [('Content-Type', 'application/json')])
@@ -21,4 +21,7 @@
 
 import audit_log
 import audit_rule
+import audit_snapshot
 import models
+import registry
+import sql_db
@@ -19,12 +19,25 @@
 #
 ##############################################################################
 
-from odoo import api, fields, models, _
-from odoo.exceptions import UserError
+from collections import defaultdict
+from datetime import datetime, timedelta
+import gzip
+import json
+import logging
+import os
+import time
+
+from odoo import api, fields, models, SUPERUSER_ID, _
+from odoo.exceptions import AccessError, UserError
+
+from ..tools import JsonbSerialized
+
+_logger = logging.getLogger(__package__)
 
 
 class AuditLog(models.Model):
     _name = 'audit.log'
+    _inherit = ['partition.mixin']
     _description = 'Audit Log'
     _order = 'create_date desc, id desc'
 
@@ -35,78 +48,332 @@ class AuditLog(models.Model):
     model = fields.Char(related='model_id.model', store=True, readonly=True, index=True)
     res_id = fields.Integer('Resource Id', readonly=True)
     method = fields.Char('Method', size=64, readonly=True)
-    data = fields.Serialized('Data', readonly=True)
+    data = JsonbSerialized('Data', readonly=True)
     data_html = fields.Html('HTML Data', readonly=True, compute='_render_html')
 
-    @api.one
+    @api.model
+    def _get_names(self, ids_by_model):
+        """Return {model: {id: display name}} with one name_get per model"""
+        names = {}
+        for model, ids in ids_by_model.iteritems():
+            records = self.env[model].browse(list(ids)).exists()
+            names[model] = dict(records.name_get())
+        return names
+
+    @api.multi
     def _get_name(self):
-        if self.model_id and self.res_id:
-            record = self.env[self.model_id.model].browse(self.res_id).exists()
-            if record:
-                self.name = record.display_name
-            else:
-                data = self.data or {}
-                rec_name = self.env[self.model_id.model]._rec_name
-                if rec_name in data['new']:
-                    self.name = data['new'][rec_name]
-                elif rec_name in data['old']:
-                    self.name = data['old'][rec_name]
+        ids_by_model = defaultdict(set)
+        for log in self:
+            if log.model_id and log.res_id:
+                ids_by_model[log.model_id.model].add(log.res_id)
+        names = self._get_names(ids_by_model)
+        for log in self:
+            if log.model_id and log.res_id:
+                name = names[log.model_id.model].get(log.res_id)
+                if name:
+                    log.name = name
                 else:
-                    self.name = 'id=%s' % self.res_id
-        else:
-            self.name = ''
+                    data = log.data or {}
+                    rec_name = self.env[log.model_id.model]._rec_name
+                    if rec_name in data['new']:
+                        log.name = data['new'][rec_name]
+                    elif rec_name in data['old']:
+                        log.name = data['old'][rec_name]
+                    else:
+                        log.name = 'id=%s' % log.res_id
+            else:
+                log.name = ''
+
+    @api.model
+    def _get_references(self, field, value, ids_by_model):
+        """Add to ids_by_model the ids of the records referenced by value"""
+        if not field or not value:
+            return
+        if field.type == 'many2one':
+            ids_by_model[field.comodel_name].add(value)
+        elif field.type == 'reference':
+            res_model, res_id = value.split(',')
+            ids_by_model[res_model].add(int(res_id))
+        elif field.type in ('one2many', 'many2many'):
+            ids_by_model[field.comodel_name].update(value)
 
     @api.multi
-    def _format_value(self, field, value):
+    def _get_fields(self):
+        self.ensure_one()
+        data = self.data or {}
+        RecordModel = self.env[self.model_id.model]
+        for fname in set(data['new'].keys() + data['old'].keys()):
+            field = RecordModel._fields.get(fname) or RecordModel._inherit_fields.get(fname)
+            yield fname, field
+
+    @api.multi
+    def _format_value(self, field, value, names=None):
         self.ensure_one()
         if not value and field.type not in ('boolean', 'integer', 'float'):
             return ''
+        if names is None:
+            ids_by_model = defaultdict(set)
+            self._get_references(field, value, ids_by_model)
+            names = self._get_names(ids_by_model)
         if field.type == 'selection':
             selection = field.selection
             if callable(selection):
                 selection = selection(self.env[self.model_id.model])
             return dict(selection).get(value, value)
         if field.type == 'many2one' and value:
-            return self.env[field.comodel_name].browse(value).exists().display_name or value
+            return names[field.comodel_name].get(value) or value
         if field.type == 'reference' and value:
             res_model, res_id = value.split(',')
-            return self.env[res_model].browse(int(res_id)).exists().display_name or value
+            return names[res_model].get(int(res_id)) or value
         if field.type in ('one2many', 'many2many') and value:
-            return ', '.join([self.env[field.comodel_name].browse(rec_id).exists().display_name or str(rec_id)
-                              for rec_id in value])
+            return ', '.join([names[field.comodel_name].get(rec_id) or str(rec_id) for rec_id in value])
         if field.type == 'binary' and value:
             return '&lt;binary data&gt;'
         return value
 
     @api.multi
-    def _get_content(self):
+    def _get_content(self, names=None):
         self.ensure_one()
         content = []
         data = self.data or {}
-        RecordModel = self.env[self.model_id.model]
-        for fname in set(data['new'].keys() + data['old'].keys()):
-            field = RecordModel._fields.get(fname) or RecordModel._inherit_fields.get(fname)
-            old_value = self._format_value(field, data['old'].get(fname, ''))
-            new_value = self._format_value(field, data['new'].get(fname, ''))
+        for fname, field in self._get_fields():
+            old_value = self._format_value(field, data['old'].get(fname, ''), names)
+            new_value = self._format_value(field, data['new'].get(fname, ''), names)
             if old_value != new_value:
                 label = field.get_description(self.env)['string']
                 content.append((label, old_value, new_value))
         return content
 
-    @api.one
+    @api.multi
     def _render_html(self):
+        # Resolve names of referenced records for all logs at once
+        ids_by_model = defaultdict(set)
+        for log in self:
+            data = log.data or {}
+            for fname, field in log._get_fields():
+                for age in ('old', 'new'):
+                    self._get_references(field, data[age].get(fname), ids_by_model)
+        names = self._get_names(ids_by_model)
         thead = ''
         for head in (_('Field'), _('Old value'), _('New value')):
             thead += '<th>%s</th>' % head
         thead = '<thead><tr>%s</tr></thead>' % thead
-        tbody = ''
-        for line in self._get_content():
-            row = ''
-            for item in line:
-                row += '<td>%s</td>' % item
-            tbody += '<tr>%s</tr>' % row
-        tbody = '<tbody>%s</tbody>' % tbody
-        self.data_html = '<table class="o_list_view table table-condensed table-striped">%s%s</table>' % (thead, tbody)
+        for log in self:
+            tbody = ''
+            for line in log._get_content(names):
+                row = ''
+                for item in line:
+                    row += '<td>%s</td>' % item
+                tbody += '<tr>%s</tr>' % row
+            tbody = '<tbody>%s</tbody>' % tbody
+            log.data_html = '<table class="o_list_view table table-condensed table-striped">%s%s</table>' % \
+                (thead, tbody)
+
+    _log_columns = ['user_id', 'model_id', 'model', 'res_id', 'method', 'data']
+
+    @api.model_cr
+    def _convert_data_to_jsonb(self, table):
+        self._cr.execute("""SELECT data_type FROM information_schema.columns
+            WHERE table_name = %s AND column_name = 'data'""", (table,))
+        res = self._cr.fetchone()
+        if res and res[0] == 'text':
+            _logger.info('Converting %s.data into jsonb...', table)
+            self._cr.execute('ALTER TABLE %s ALTER COLUMN data TYPE jsonb USING data::jsonb' % table)
+
+    @api.model_cr_context
+    def _auto_init(self):
+        self._convert_data_to_jsonb(self._table)
+        return super(AuditLog, self)._auto_init()
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute("""CREATE TABLE IF NOT EXISTS audit_log_queue (
+            id serial PRIMARY KEY,
+            create_date timestamp without time zone NOT NULL,
+            user_id integer NOT NULL,
+            model_id integer NOT NULL,
+            model varchar,
+            res_id integer,
+            method varchar(64),
+            data jsonb
+        )""")
+        self._convert_data_to_jsonb('audit_log_queue')
+        if self._partition_table():
+            self.manage_partitions()
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS audit_log_model_id_res_id_create_date_index
+            ON audit_log (model_id, res_id, create_date DESC, id DESC)""")
+        self._cr.execute("CREATE INDEX IF NOT EXISTS audit_log_data_index ON audit_log USING gin (data)")
+        # Key existence operator on data -> 'new' or 'old' cannot use the index on data
+        for age in ('new', 'old'):
+            self._cr.execute("CREATE INDEX IF NOT EXISTS audit_log_data_%s_index ON audit_log USING gin ((data -> '%s'))"
+                             % (age, age))
+
+    @api.model
+    def _get_row_params(self, vals):
+        data_field = self._fields['data']
+        return [data_field.convert_to_column(vals[column], self)
+                if column == 'data' and not isinstance(vals[column], basestring) else vals[column]
+                for column in self._log_columns]
+
+    @api.model
+    def _bulk_create(self, vals_list):
+        """Insert audit logs with a single multi-row INSERT
+
+        Bypass ORM create in order to avoid one query per changed record.
+        Each dict of vals_list must provide the stored columns of audit.log
+        (i.e. user_id, model_id, model, res_id, method and data).
+        """
+        if not vals_list:
+            return self.browse()
+        row = "(%s)" % ', '.join(["%s", "(now() at time zone 'UTC')"] * 2 + ['%s'] * len(self._log_columns))
+        params = []
+        for vals in vals_list:
+            params += [self._uid, self._uid] + self._get_row_params(vals)
+        query = 'INSERT INTO %s (create_uid, create_date, write_uid, write_date, %s) VALUES %s RETURNING id' % \
+            (self._table, ', '.join(self._log_columns), ', '.join([row] * len(vals_list)))
+        self._cr.execute(query, params)
+        return self.browse([res[0] for res in self._cr.fetchall()])
+
+    @api.model
+    def _enqueue(self, vals_list):
+        """Push audit logs into audit_log_queue, see process_queue"""
+        if not vals_list:
+            return
+        row = "(%s)" % ', '.join(["(now() at time zone 'UTC')"] + ['%s'] * len(self._log_columns))
+        params = []
+        for vals in vals_list:
+            params += self._get_row_params(vals)
+        query = 'INSERT INTO audit_log_queue (create_date, %s) VALUES %s' % \
+            (', '.join(self._log_columns), ', '.join([row] * len(vals_list)))
+        self._cr.execute(query, params)
+
+    @api.model
+    def process_queue(self, batch_size=1000, autocommit=True):
+        """Materialize queued logs into audit_log, in batches
+
+        Only one worker processes the queue at a time and logs are inserted
+        in queue order, so logs of a same record stay strictly ordered.
+        Logs keep the date of the original transaction.
+        If autocommit, each batch is committed in its own transaction.
+        """
+        columns = ', '.join(self._log_columns)
+        query = """WITH queued AS (
+            DELETE FROM audit_log_queue
+            WHERE id IN (SELECT id FROM audit_log_queue ORDER BY id LIMIT %%s)
+            RETURNING *
+        )
+        INSERT INTO %s (create_uid, create_date, write_uid, write_date, %s)
+        SELECT %%s, create_date, %%s, create_date, %s FROM queued ORDER BY id""" % (self._table, columns, columns)
+        while True:
+            self._cr.execute("SELECT pg_try_advisory_xact_lock(hashtext('audit_log_queue'))")
+            if not self._cr.fetchone()[0]:
+                _logger.info('Audit log queue is already being processed')
+                return False
+            stats = self.get_queue_stats()
+            _logger.info('Audit log queue: %(count)s logs, lag of %(lag)s seconds' % stats)
+            if not stats['count']:
+                return True
+            self._cr.execute(query, (batch_size, self._uid, self._uid))
+            if autocommit:
+                self._cr.commit()
+
+    @api.model
+    def get_queue_stats(self):
+        """Return the number of queued logs and the age in seconds of the oldest one"""
+        self._cr.execute("""SELECT count(*),
+            COALESCE(EXTRACT(EPOCH FROM (now() at time zone 'UTC') - min(create_date)), 0)
+            FROM audit_log_queue""")
+        count, lag = self._cr.fetchone()
+        return {'count': count, 'lag': lag}
+
+    @api.model
+    def get_history(self, model, res_id, before=None, limit=80):
+        """Return the audit logs of a record, from the most recent one
+
+        Use keyset pagination: pass the id of the last log of the previous
+        page as before to get the next page.
+        """
+        self.check_access_rights('read')
+        query = """SELECT l.id FROM audit_log l
+            JOIN ir_model m ON m.id = l.model_id
+            WHERE m.model = %s AND l.res_id = %s"""
+        params = [model, res_id]
+        if before:
+            query += " AND (l.create_date, l.id) < (SELECT create_date, id FROM audit_log WHERE id = %s)"
+            params.append(before)
+        query += " ORDER BY l.create_date DESC, l.id DESC LIMIT %s"
+        params.append(limit)
+        self._cr.execute(query, params)
+        return self.browse([res[0] for res in self._cr.fetchall()])
+
+    @api.model
+    def search_changes(self, model, fname, value=None, age='new'):
+        """Return the logs of model changing fname, to value if given
+
+        Set age to 'old' to search changes from value.
+        """
+        assert age in ('new', 'old'), "age must be 'new' or 'old'"
+        self.check_access_rights('read')
+        query = "SELECT id FROM audit_log WHERE model = %s"
+        params = [model]
+        if value is None:
+            query += " AND data -> %s ? %s"
+            params += [age, fname]
+        else:
+            query += " AND data @> %s::jsonb"
+            params.append(json.dumps({age: {fname: value}}))
+        self._cr.execute(query + " ORDER BY create_date DESC, id DESC", params)
+        return self.browse([res[0] for res in self._cr.fetchall()])
+
+    @api.model
+    def _archive(self, query, archive_path, file_name):
+        file_path = os.path.join(archive_path, file_name)
+        with gzip.open(file_path, 'wb') as archive:
+            self._cr.copy_expert('COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING utf8)' % query,
+                                 archive)
+        return file_path
+
+    @api.model
+    def archive_and_delete_old_logs(self, nb_days=365, archive_path=''):
+        """Drop audit logs older than nb_days, after exporting them into gzipped CSV files
+        stored in archive_path if given
+
+        If audit_log is partitioned, whole partitions are detached and dropped,
+        and old rows are deleted from the default partition.
+        Audit snapshots older than nb_days are deleted too.
+        Reserved to superuser, e.g. via cron, as it bypasses the protection of audit logs.
+        """
+        if self._uid != SUPERUSER_ID:
+            raise AccessError(_('Only superuser can archive and delete audit logs!'))
+        limit_date = datetime.utcnow() - timedelta(days=nb_days)
+        where_clause = "create_date < '%s'" % fields.Datetime.to_string(limit_date)
+        # Snapshots older than the remaining logs cannot be used to rebuild records anymore
+        self.env['audit.snapshot']._purge(limit_date)
+        if not self._is_partitioned():
+            if archive_path:
+                self._archive('SELECT * FROM %s WHERE %s' % (self._table, where_clause), archive_path,
+                              time.strftime('%s_%%Y%%m%%d_%%H%%M%%S.csv.gz' % self._table))
+            self._cr.execute('DELETE FROM %s WHERE %s' % (self._table, where_clause))
+            return True
+        for partition, upper_bound in self._get_partitions():
+            if upper_bound > limit_date:
+                break
+            if archive_path:
+                self._archive('SELECT * FROM "%s"' % partition, archive_path, '%s.csv.gz' % partition)
+            self._cr.execute('ALTER TABLE "%s" DETACH PARTITION "%s"' % (self._table, partition))
+            self._cr.execute('DROP TABLE "%s"' % partition)
+            _logger.info('Audit logs partition %s dropped', partition)
+        # Rows out of all partitions, e.g. backfilled after the drop of their partition
+        default_partition = self._get_default_partition()
+        if default_partition:
+            self._cr.execute('SELECT 1 FROM "%s" WHERE %s LIMIT 1' % (default_partition, where_clause))
+            if self._cr.rowcount:
+                if archive_path:
+                    self._archive('SELECT * FROM "%s" WHERE %s' % (default_partition, where_clause), archive_path,
+                                  time.strftime('%s_%%Y%%m%%d_%%H%%M%%S.csv.gz' % default_partition))
+                self._cr.execute('DELETE FROM "%s" WHERE %s' % (default_partition, where_clause))
+                _logger.info('%s old audit logs deleted from partition %s', self._cr.rowcount, default_partition)
+        return True
 
     @api.multi
     def unlink(self):
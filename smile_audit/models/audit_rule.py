@@ -19,13 +19,14 @@
 #
 ##############################################################################
 
+import json
 import logging
 
 from odoo import api, fields, models, tools, _
-from odoo.modules.registry import RegistryManager
 from odoo.tools.safe_eval import safe_eval
 
-from ..tools import audit_decorator
+from ..tools import add_stats, audit_decorator, pop_stats
+from .sql_db import buffer_audit_logs
 
 _logger = logging.getLogger(__package__)
 
@@ -39,12 +40,39 @@ class AuditRule(models.Model):
     log_create = fields.Boolean('Log Creation', default=False)
     log_write = fields.Boolean('Log Update', default=True)
     log_unlink = fields.Boolean('Log Deletion', default=True)
+    log_at_commit = fields.Boolean('Log at Commit', default=False,
+                                   help='Buffer logs until the transaction is committed and merge '
+                                        'successive changes of a same record into a single log.')
+    log_async = fields.Boolean('Asynchronous Logging', default=False,
+                               help='Push logs into a queue processed by a scheduled action, '
+                                    'so that audit logs insertion does not slow down user operations.')
     state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], 'Status', default='draft', readonly=True)
     model_id = fields.Many2one('ir.model', 'Model', required=True,
                                help='Select model for which you want to generate log.',
                                domain=[('model', '!=', 'audit.log')],
                                readonly=True, states={'draft': [('readonly', False)]})
+    field_ids = fields.Many2many('ir.model.fields', 'audit_rule_field_rel', 'rule_id', 'field_id', 'Audited Fields',
+                                 domain="[('model_id', '=', model_id)]",
+                                 help='Leave empty to audit all fields.')
+    ignored_field_ids = fields.Many2many('ir.model.fields', 'audit_rule_ignored_field_rel', 'rule_id', 'field_id',
+                                         'Ignored Fields', domain="[('model_id', '=', model_id)]",
+                                         help='Changes of these fields are not logged.')
+    ignored_user_ids = fields.Many2many('res.users', 'audit_rule_ignored_user_rel', 'rule_id', 'user_id',
+                                        'Ignored Users', help='Operations of these users, e.g. cron users, '
+                                                              'are not logged.')
+    ignored_context_keys = fields.Char('Ignored Context Keys',
+                                       help='Comma-separated list of context keys: operations are not logged '
+                                            'if one of these keys is set in context.')
     action_id = fields.Many2one('ir.actions.act_window', 'Client Action', readonly=True)
+    model = fields.Char(related='model_id.model', readonly=True)
+    stat_operations = fields.Integer('Logged Operations', compute='_get_stats')
+    stat_rows = fields.Integer('Logs Written', compute='_get_stats')
+    stat_bytes = fields.Float('Data Size (bytes)', digits=(16, 0), compute='_get_stats')
+    stat_pre_read_time = fields.Float('Pre-read Time (s)', compute='_get_stats')
+    stat_post_read_time = fields.Float('Post-read Time (s)', compute='_get_stats')
+    stat_log_time = fields.Float('Logging Time (s)', compute='_get_stats')
+    stat_avg_time = fields.Float('Average Overhead (ms)', compute='_get_stats',
+                                 help='Average time added by audit to each logged operation')
     values_id = fields.Many2one('ir.values', "Add in the 'More' menu", readonly=True)
 
     _sql_constraints = [
@@ -102,6 +130,19 @@ class AuditRule(models.Model):
         return True
 
     _methods = ['_create', '_write', 'unlink']
+    _stat_columns = ['operations', 'rows', 'bytes', 'pre_read_time', 'post_read_time', 'log_time']
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute("""CREATE TABLE IF NOT EXISTS audit_rule_stat (
+            rule_id integer PRIMARY KEY REFERENCES audit_rule ON DELETE CASCADE,
+            operations bigint NOT NULL DEFAULT 0,
+            rows bigint NOT NULL DEFAULT 0,
+            bytes bigint NOT NULL DEFAULT 0,
+            pre_read_time double precision NOT NULL DEFAULT 0,
+            post_read_time double precision NOT NULL DEFAULT 0,
+            log_time double precision NOT NULL DEFAULT 0
+        )""")
 
     @api.model
     @tools.ormcache()
@@ -113,9 +154,64 @@ class AuditRule(models.Model):
                  if getattr(rule, 'log_%s' % method.replace('_', ''))}
                 for rule in rules}
 
+    @api.model
+    @tools.ormcache('rule_id', 'model_name', 'fnames')
+    def _get_fields_to_read(self, rule_id, model_name, fnames=None):
+        """Return the names of the fields to read in order to log a change of fnames
+
+        Fields computed from fnames on the same record are added, and the list
+        is restricted to the fields audited by the rule. If fnames is None,
+        all fields are considered.
+        """
+        RecordModel = self.env[model_name]
+        if fnames is None:
+            fields_to_read = set(RecordModel._fields)
+        else:
+            fields_to_read = set()
+            todo = [RecordModel._fields[fname] for fname in fnames if fname in RecordModel._fields]
+            while todo:
+                field = todo.pop()
+                if field.name in fields_to_read:
+                    continue
+                fields_to_read.add(field.name)
+                for target, path in getattr(field, '_triggers', ()):
+                    if target.model_name == model_name and path == 'id':
+                        todo.append(target)
+        rule = self.sudo().browse(rule_id)
+        audited_fields = rule.field_ids.mapped('name')
+        if audited_fields:
+            fields_to_read &= set(audited_fields)
+        ignored_fields = set(self._ignored_fields) | set(rule.ignored_field_ids.mapped('name'))
+        return tuple(sorted(fields_to_read - ignored_fields))
+
+    @api.model
+    @tools.ormcache('rule_id')
+    def _get_ignored_users_and_context_keys(self, rule_id):
+        rule = self.sudo().browse(rule_id)
+        context_keys = [key.strip() for key in (rule.ignored_context_keys or '').split(',')]
+        return frozenset(rule.ignored_user_ids.ids), tuple(key for key in context_keys if key)
+
+    @staticmethod
+    def _find_audit_wrapper(RecordModel, method_name):
+        """Return (caller, wrapper), wrapper being the audit wrapper found in the origin chain
+        of the method, even if other modules patched it afterwards, and caller the method calling it
+        """
+        caller, method = None, getattr(RecordModel, method_name)
+        while method:
+            method = getattr(method, '__func__', method)
+            if getattr(method, 'audit_wrapper', False):
+                return caller, method
+            caller, method = method, getattr(method, 'origin', None)
+        return None, None
+
     @api.model_cr
     def _register_hook(self, ids=None):
-        self = self.sudo()
+        """Patch methods of audited models, and restore them if rules are inactive
+
+        This method is idempotent, so it is also called in other workers
+        when audit rules change, see registry.py.
+        """
+        self = self.sudo().with_context(active_test=False)
         updated = False
         if ids:
             rules = self.browse(ids)
@@ -124,24 +220,24 @@ class AuditRule(models.Model):
         for rule in rules:
             if rule.model_id.model not in self.env.registry.models:
                 continue
-            RecordModel = self.env[rule.model_id.model]
-            if rule.active:
+            RecordModel = type(self.env[rule.model_id.model])
+            audited = getattr(RecordModel, 'audit_rule', False)
+            if rule.active and not audited:
                 for method in self._methods:
-                    RecordModel._patch_method(method, audit_decorator(method))
+                    # Avoid stacking a second wrapper, which would log twice
+                    if not self._find_audit_wrapper(RecordModel, method)[1]:
+                        RecordModel._patch_method(method, audit_decorator(method))
                 RecordModel.audit_rule = True
                 updated = True
-            if not rule.active:
+            if not rule.active and audited:
                 for method_name in self._methods:
-                    method = getattr(RecordModel, method_name)
-                    while hasattr(method, 'origin'):
-                        if method.__name__ == 'audit_wrapper':
-                            RecordModel._revert_method(method_name)
-                            break
-                        method = method.origin
-                del RecordModel.audit_rule
+                    caller, wrapper = self._find_audit_wrapper(RecordModel, method_name)
+                    if caller:
+                        caller.origin = wrapper.origin
+                    elif wrapper:
+                        RecordModel._revert_method(method_name)
+                RecordModel.audit_rule = False
                 updated = True
-        if updated:
-            self.clear_caches()
         return updated
 
     @api.model
@@ -150,21 +246,23 @@ class AuditRule(models.Model):
         vals['state'] = 'done'
         rule = super(AuditRule, self).create(vals)
         rule.update_rule()
-        if self._register_hook(rule.id):
-            RegistryManager.signal_registry_change(self.env.cr.dbname)
+        self._register_hook(rule.id)
+        # Invalidate audit rules cache in all workers, that re-patch audited models, instead of reloading registry
+        self.clear_caches()
         return rule
 
     @api.multi
     def write(self, vals):
         res = super(AuditRule, self).write(vals)
         self.update_rule()
-        if self._register_hook(self._ids):
-            RegistryManager.signal_registry_change(self.env.cr.dbname)
+        self._register_hook(self._ids)
+        self.clear_caches()
         return res
 
     @api.multi
     def unlink(self):
-        self.update_rule(force_deactivation=True)
+        # Deactivate rules to restore original methods of audited models
+        self.write({'active': False})
         return super(AuditRule, self).unlink()
 
     _ignored_fields = ['__last_update', 'message_ids', 'message_last_post']
@@ -196,13 +294,78 @@ class AuditRule(models.Model):
     def log(self, method, old_values=None, new_values=None):
         if old_values or new_values:
             data = self._format_data_to_log(old_values, new_values)
+            rule = self.sudo()
+            vals_list = [{
+                'user_id': self._uid,
+                'model_id': rule.model_id.id,
+                'model': rule.model_id.model,
+                'res_id': res_id,
+                'method': method,
+                'data': data[res_id],
+            } for res_id in data]
             AuditLog = self.env['audit.log'].sudo()
-            for res_id in data:
-                log = AuditLog.create({
-                    'user_id': self._uid,
-                    'model_id': self.sudo().model_id.id,
-                    'res_id': res_id,
-                    'method': method,
-                    'data': data[res_id],
-                })
+            if rule.log_at_commit:
+                size = sum(len(json.dumps(vals['data'])) for vals in vals_list)
+                buffer_audit_logs(self._cr, vals_list, rule.log_async)
+            else:
+                for vals in vals_list:
+                    vals['data'] = json.dumps(vals['data'])
+                size = sum(len(vals['data']) for vals in vals_list)
+                if rule.log_async:
+                    AuditLog._enqueue(vals_list)
+                else:
+                    AuditLog._bulk_create(vals_list)
+            add_stats(self._cr.dbname, self.id, rows=len(vals_list), bytes=size)
+        return True
+
+    @api.model
+    def _flush_stats(self, force=False):
+        """Add counters in memory of this worker to audit_rule_stat table,
+        at most once per FLUSH_INTERVAL unless force
+
+        Counters are flushed after each commit, see models/sql_db.py.
+        """
+        self._save_stats(pop_stats(self._cr.dbname, force))
+
+    @api.model
+    def _save_stats(self, stats):
+        """Add counters to audit_rule_stat table, ignoring unknown rules,
+        e.g. deleted or created in a rolled back transaction
+        """
+        columns = self._stat_columns
+        query = """INSERT INTO audit_rule_stat (rule_id, %s)
+            SELECT %%s, %s WHERE EXISTS (SELECT 1 FROM audit_rule WHERE id = %%s)
+            ON CONFLICT (rule_id) DO UPDATE SET %s""" % (
+            ', '.join(columns), ', '.join(['%s'] * len(columns)),
+            ', '.join(['%s = audit_rule_stat.%s + EXCLUDED.%s' % (column, column, column) for column in columns]))
+        for rule_id, counters in stats.iteritems():
+            self._cr.execute(query, [rule_id] + [counters.get(column, 0) for column in columns] + [rule_id])
+
+    @api.multi
+    def _get_stats(self):
+        stats = {}
+        if self.ids:
+            self._cr.execute("SELECT rule_id, %s FROM audit_rule_stat WHERE rule_id IN %%s"
+                             % ', '.join(self._stat_columns), (tuple(self.ids),))
+            for row in self._cr.dictfetchall():
+                stats[row.pop('rule_id')] = row
+        for rule in self:
+            counters = stats.get(rule.id, {})
+            for column in self._stat_columns:
+                rule['stat_%s' % column] = counters.get(column, 0)
+            rule.stat_avg_time = rule.stat_operations and 1000.0 * (
+                rule.stat_pre_read_time + rule.stat_post_read_time + rule.stat_log_time) / rule.stat_operations
+
+    @api.model
+    def get_stats(self):
+        """Return audit rules statistics as a list of dicts"""
+        fields_to_read = ['name', 'model'] + ['stat_%s' % column for column in self._stat_columns] + ['stat_avg_time']
+        return self.with_context(active_test=False).search([]).read(fields_to_read)
+
+    @api.multi
+    def reset_stats(self):
+        # Raw DELETE below bypasses access rights
+        self.check_access_rights('write')
+        self._flush_stats(force=True)
+        self._cr.execute("DELETE FROM audit_rule_stat WHERE rule_id IN %s", (tuple(self.ids),))
         return True
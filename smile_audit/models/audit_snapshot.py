@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import json
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__package__)
+
+
+class AuditSnapshot(models.Model):
+    _name = 'audit.snapshot'
+    _description = 'Audit Snapshot'
+    _log_access = False
+    _order = 'date desc, id desc'
+
+    date = fields.Datetime('Date', required=True, readonly=True)
+    model = fields.Char('Model', required=True, readonly=True)
+    res_id = fields.Integer('Resource Id', required=True, readonly=True)
+    data = fields.Serialized('Data', readonly=True)
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS audit_snapshot_model_res_id_date_index
+            ON audit_snapshot (model, res_id, date)""")
+
+    @api.model
+    def create_snapshots(self, interval=100):
+        """Store the values of audited records changed at least interval times since their last snapshot
+
+        Snapshots bound the number of logs to replay in order to rebuild a record at a given date.
+        Only records changed since the last snapshots of their model are candidates: the others
+        were already below interval changes at that time.
+        """
+        rules = self.env['audit.rule'].sudo().search([])
+        for rule in rules:
+            model = rule.model_id.model
+            if model not in self.env.registry.models:
+                continue
+            self._cr.execute("SELECT max(date) FROM audit_snapshot WHERE model = %s", (model,))
+            last_date = self._cr.fetchone()[0]
+            candidate_clause = last_date and "AND create_date > '%s'" % last_date or ''
+            self._cr.execute("""WITH candidate AS (
+                    SELECT DISTINCT res_id FROM audit_log WHERE model_id = %%s %s
+                ), snapshot AS (
+                    SELECT res_id, max(date) AS date FROM audit_snapshot
+                    WHERE model = %%s AND res_id IN (SELECT res_id FROM candidate)
+                    GROUP BY res_id
+                )
+                SELECT l.res_id FROM audit_log l
+                JOIN candidate c ON c.res_id = l.res_id
+                LEFT JOIN snapshot s ON s.res_id = l.res_id
+                WHERE l.model_id = %%s AND (s.date IS NULL OR l.create_date > s.date)
+                GROUP BY l.res_id HAVING count(*) >= %%s""" % candidate_clause,
+                             (rule.model_id.id, model, rule.model_id.id, interval))
+            res_ids = [res[0] for res in self._cr.fetchall()]
+            if not res_ids:
+                continue
+            records = self.env[model].sudo().with_context(active_test=False).browse(res_ids).exists()
+            fields_to_read = list(rule._get_fields_to_read(rule.id, model))
+            if not records or not fields_to_read:
+                continue
+            values = records.read(fields_to_read, load='_classic_write')
+            # Date snapshots after reading, so that any change included in values is logged before this date
+            self._cr.execute("SELECT clock_timestamp() at time zone 'UTC'")
+            date = self._cr.fetchone()[0]
+            data_field = self._fields['data']
+            for vals in values:
+                res_id = vals.pop('id')
+                self._cr.execute("INSERT INTO audit_snapshot (date, model, res_id, data) VALUES (%s, %s, %s, %s)",
+                                 (date, model, res_id, data_field.convert_to_column(vals, self)))
+            _logger.info('%s audit snapshots created for %s', len(values), model)
+        return True
+
+    @api.model
+    def _purge(self, limit_date):
+        """Delete snapshots older than limit_date, whose logs are dropped by audit.log archiving"""
+        self._cr.execute("DELETE FROM audit_snapshot WHERE date < %s", (fields.Datetime.to_string(limit_date),))
+        _logger.info('%s audit snapshots older than %s deleted', self._cr.rowcount, limit_date)
+        return True
+
+    @api.model
+    def get_values_at(self, model, res_ids, date):
+        """Return {res_id: {field: value}} the values at date of the fields of records
+        changed since date
+
+        Start from the first snapshot after date, or from current values if there is
+        none, and replay logs backwards until date, for all records at once.
+        """
+        if not res_ids:
+            return {}
+        audit_rules = self.env['audit.rule']._check_audit_rule().get(model, {})
+        if not audit_rules:
+            return {}
+        date_operator = audit_rules.get('create') and '>' or '>='
+        res_ids = tuple(res_ids)
+        values = {}
+        self._cr.execute("""SELECT DISTINCT ON (res_id) res_id, date, data FROM audit_snapshot
+            WHERE model = %s AND res_id IN %s AND date > %s
+            ORDER BY res_id, date""", (model, res_ids, date))
+        for res_id, _snapshot_date, data in self._cr.fetchall():
+            values[res_id] = json.loads(data or '{}')
+        self._cr.execute("""WITH snapshot AS (
+                SELECT res_id, min(date) AS date FROM audit_snapshot
+                WHERE model = %%s AND res_id IN %%s AND date > %%s
+                GROUP BY res_id
+            )
+            SELECT l.res_id, l.data FROM audit_log l
+            LEFT JOIN snapshot s ON s.res_id = l.res_id
+            WHERE l.model = %%s AND l.res_id IN %%s AND l.create_date %s %%s
+            AND (s.date IS NULL OR l.create_date <= s.date)
+            ORDER BY l.create_date DESC, l.id DESC""" % date_operator,
+                         (model, res_ids, date, model, res_ids, date))
+        for res_id, data in self._cr.fetchall():
+            values.setdefault(res_id, {}).update((data or {}).get('old', {}))
+        return values
@@ -0,0 +1,41 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from contextlib import closing
+
+from odoo import api, SUPERUSER_ID
+from odoo.modules.registry import Registry
+
+native_check_signaling = Registry.check_signaling
+
+
+def check_signaling(self):
+    cache_sequence = self.cache_sequence
+    registry = native_check_signaling(self)
+    # Audit rules changes are signaled by a cache invalidation instead of a registry reload:
+    # re-patch audited models if another worker invalidated caches
+    if registry is self and registry.cache_sequence != cache_sequence and 'audit.rule' in registry:
+        with closing(registry.cursor()) as cr:
+            api.Environment(cr, SUPERUSER_ID, {})['audit.rule']._register_hook()
+    return registry
+
+
+Registry.check_signaling = check_signaling
@@ -0,0 +1,151 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from collections import OrderedDict
+import logging
+import re
+
+from odoo import api, SUPERUSER_ID
+from odoo.sql_db import Cursor
+
+from ..tools import add_stats, pop_stats
+
+_logger = logging.getLogger(__package__)
+
+SAVEPOINT_PATTERN = re.compile(r'\s*(SAVEPOINT|ROLLBACK\s+TO(?:\s+SAVEPOINT)?|RELEASE(?:\s+SAVEPOINT)?)\s+"?([^"\s;]+)',
+                               re.IGNORECASE)
+
+native_commit = Cursor.commit
+native_execute = Cursor.execute
+native_rollback = Cursor.rollback
+
+
+def buffer_audit_logs(cr, vals_list, queued=False):
+    """Store audit logs in cursor until commit, see flush_audit_buffer"""
+    if not hasattr(cr, '_audit_buffer'):
+        cr._audit_buffer = []
+    cr._audit_buffer.extend(dict(vals, queued=queued) for vals in vals_list)
+
+
+def track_savepoint(cr, query):
+    """Keep the length of the audit buffer at each savepoint,
+    to drop the logs buffered after a savepoint when rolling back to it
+
+    Savepoints created through Cursor.savepoint or raw SQL, e.g. in BaseModel.load, are both tracked.
+    """
+    match = SAVEPOINT_PATTERN.match(query)
+    if not match:
+        return
+    command, name = match.group(1).split()[0].upper(), match.group(2)
+    if not hasattr(cr, '_audit_buffer'):
+        cr._audit_buffer = []
+    if not hasattr(cr, '_audit_savepoints'):
+        cr._audit_savepoints = []
+    savepoints = cr._audit_savepoints
+    if command == 'SAVEPOINT':
+        savepoints.append((name, len(cr._audit_buffer)))
+        return
+    # A savepoint name can be reused, the last one is concerned
+    names = [savepoint[0] for savepoint in savepoints]
+    if name not in names:
+        return
+    index = len(names) - 1 - names[::-1].index(name)
+    if command == 'ROLLBACK':
+        del cr._audit_buffer[savepoints[index][1]:]
+        del savepoints[index + 1:]
+    else:
+        del savepoints[index:]
+
+
+def flush_audit_buffer(cr):
+    """Write audit logs stored in cursor, merged per (model, res_id, method)"""
+    buffer = getattr(cr, '_audit_buffer', None)
+    cr._audit_savepoints = []
+    if not buffer:
+        return
+    cr._audit_buffer = []
+    merged_buffer = OrderedDict()
+    for vals in buffer:
+        key = (vals['model'], vals['res_id'], vals['method'])
+        if key not in merged_buffer:
+            merged_buffer[key] = dict(vals, data={age: dict(vals['data'][age]) for age in ('old', 'new')})
+            continue
+        data = merged_buffer[key]['data']
+        for field, value in vals['data']['old'].iteritems():
+            data['old'].setdefault(field, value)
+        data['new'].update(vals['data']['new'])
+    vals_list, queued_vals_list = [], []
+    for vals in merged_buffer.itervalues():
+        data = vals['data']
+        for field in set(data['old'].keys()) | set(data['new'].keys()):
+            if data['old'].get(field) == data['new'].get(field):
+                data['old'].pop(field, None)
+                data['new'].pop(field, None)
+        if data['old'] or data['new']:
+            (queued_vals_list if vals.pop('queued') else vals_list).append(vals)
+    # Commit can be called outside of any environment management, e.g. at the end of a cron job
+    with api.Environment.manage():
+        AuditLog = api.Environment(cr, SUPERUSER_ID, {})['audit.log']
+        AuditLog._bulk_create(vals_list)
+        AuditLog._enqueue(queued_vals_list)
+
+
+def flush_audit_stats(cr):
+    """Add audit statistics counted in this worker to database, in a transaction of their own,
+    at most once per FLUSH_INTERVAL
+    """
+    stats = pop_stats(cr.dbname)
+    if not stats:
+        return
+    try:
+        with api.Environment.manage():
+            api.Environment(cr, SUPERUSER_ID, {})['audit.rule']._save_stats(stats)
+        native_commit(cr)
+    except Exception:
+        _logger.warning('Audit statistics not saved', exc_info=True)
+        native_rollback(cr)
+        for rule_id, counters in stats.iteritems():
+            add_stats(cr.dbname, rule_id, **counters)
+
+
+def commit(self):
+    flush_audit_buffer(self)
+    result = native_commit(self)
+    flush_audit_stats(self)
+    return result
+
+
+def rollback(self):
+    self._audit_buffer = []
+    self._audit_savepoints = []
+    return native_rollback(self)
+
+
+def execute(self, query, *args, **kwargs):
+    res = native_execute(self, query, *args, **kwargs)
+    if isinstance(query, basestring):
+        track_savepoint(self, query)
+    return res
+
+
+Cursor.commit = commit
+Cursor.execute = execute
+Cursor.rollback = rollback
@@ -20,3 +20,5 @@
 ##############################################################################
 
 from decorator import audit_decorator
+from fields import JsonbSerialized
+from stats import add_stats, pop_stats
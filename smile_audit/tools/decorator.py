@@ -19,44 +19,79 @@
 #
 ##############################################################################
 
+import time
+
 from odoo import api
 
+from .stats import add_stats
+
 
 def audit_decorator(method):
 
     def get_audit_rule(self, method):
         AuditRule = self.env['audit.rule']
         rule_id = AuditRule._check_audit_rule().get(self._name, {}).get(method)
-        return AuditRule.browse(rule_id) if rule_id else None
+        if not rule_id:
+            return None
+        ignored_user_ids, ignored_context_keys = AuditRule._get_ignored_users_and_context_keys(rule_id)
+        if self._uid in ignored_user_ids or any(self._context.get(key) for key in ignored_context_keys):
+            return None
+        return AuditRule.browse(rule_id)
+
+    def get_fields_to_read(self, rule, fnames=None):
+        readable_fields = set(self.check_field_access_rights('read', None))
+        return [fname for fname in rule._get_fields_to_read(rule.id, self._name, fnames)
+                if fname in readable_fields]
+
+    def add_timing(self, rule, **timing):
+        add_stats(self._cr.dbname, rule.id, operations=1, **timing)
 
     @api.model
     def audit_create(self, vals):
         record = audit_create.origin(self, vals)
         rule = get_audit_rule(self, 'create')
-        if rule:
-            new_values = record.read(load='_classic_write')
+        fields_to_read = rule and get_fields_to_read(self, rule)
+        if fields_to_read:
+            start = time.time()
+            new_values = record.read(fields_to_read, load='_classic_write')
+            post_read_end = time.time()
             rule.log('create', new_values=new_values)
+            add_timing(self, rule, post_read_time=post_read_end - start, log_time=time.time() - post_read_end)
         return record
 
     @api.multi
     def audit_write(self, vals):
         rule = get_audit_rule(self, 'write')
-        if rule:
-            old_values = self.read(load='_classic_write')
+        fields_to_read = rule and get_fields_to_read(self, rule, tuple(sorted(vals)))
+        if fields_to_read:
+            start = time.time()
+            old_values = self.read(fields_to_read, load='_classic_write')
+            pre_read_time = time.time() - start
         result = audit_write.origin(self, vals)
-        if rule:
-            new_values = self.read(load='_classic_write')
+        if fields_to_read:
+            start = time.time()
+            new_values = self.read(fields_to_read, load='_classic_write')
+            post_read_end = time.time()
             rule.log('write', old_values, new_values)
+            add_timing(self, rule, pre_read_time=pre_read_time, post_read_time=post_read_end - start,
+                       log_time=time.time() - post_read_end)
         return result
 
     @api.multi
     def audit_unlink(self):
         rule = get_audit_rule(self, 'unlink')
-        if rule:
-            old_values = self.read(load='_classic_write')
+        fields_to_read = rule and get_fields_to_read(self, rule)
+        if fields_to_read:
+            start = time.time()
+            old_values = self.read(fields_to_read, load='_classic_write')
+            pre_read_end = time.time()
             rule.log('unlink', old_values)
+            add_timing(self, rule, pre_read_time=pre_read_end - start, log_time=time.time() - pre_read_end)
         return audit_unlink.origin(self)
 
+    for audit_wrapper in (audit_create, audit_write, audit_unlink):
+        audit_wrapper.audit_wrapper = True
+
     if 'create' in method:
         return audit_create
     if 'write' in method:
@@ -0,0 +1,53 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from collections import defaultdict
+import threading
+import time
+
+FLUSH_INTERVAL = 60  # in seconds
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: defaultdict(float))
+_last_flush = {}
+
+
+def add_stats(dbname, rule_id, **values):
+    """Increment in memory the counters of an audit rule"""
+    with _lock:
+        counters = _stats[(dbname, rule_id)]
+        for key, value in values.iteritems():
+            counters[key] += value
+
+
+def pop_stats(dbname, force=False):
+    """Return and reset the counters of audit rules of dbname,
+    if they were not flushed for FLUSH_INTERVAL seconds or if force
+    """
+    now = time.time()
+    with _lock:
+        if not force and now - _last_flush.setdefault(dbname, now) < FLUSH_INTERVAL:
+            return {}
+        _last_flush[dbname] = now
+        stats = {}
+        for key in [key for key in _stats if key[0] == dbname]:
+            stats[key[1]] = dict(_stats.pop(key))
+    return stats
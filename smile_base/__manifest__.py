@@ -43,6 +43,7 @@ Features
     * Force to call unlink method at removal of remote object linked by a fields.many2one with ondelete='cascade'
     * Add BaseModel.bulk_create
     * Improve BaseModel.load method performance
+    * Add partition.mixin to partition a table by range on a date column
 
 Execution
 
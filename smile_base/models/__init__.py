@@ -28,6 +28,7 @@ import language
 import mail_mail
 import mail_template
 import models
+import partition_mixin
 import module
 import registry
 import sql_db
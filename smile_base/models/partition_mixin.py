@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2013 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import logging
+import re
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__package__)
+
+
+class PartitionMixin(models.AbstractModel):
+    """Partition the table of a model by range on a date column, by month or day
+
+    Partitioning requires PostgreSQL 11 or later, call _partition_table
+    then manage_partitions in init and manage_partitions regularly via cron.
+    Rows out of the range of all partitions land in a default partition,
+    moved into their partition once it is created.
+    """
+    _name = 'partition.mixin'
+    _description = 'Partitioned Table'
+
+    _partition_column = 'create_date'
+    _partition_interval = 'month'  # or 'day'
+
+    @api.model_cr
+    def _table_exist(self):
+        # Include partitioned tables, ignored by native method
+        self._cr.execute("SELECT relname FROM pg_class WHERE relkind IN ('r', 'v', 'p') AND relname = %s",
+                         (self._table,))
+        return self._cr.rowcount
+
+    @api.model
+    def _is_partitioned(self):
+        self._cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", (self._table,))
+        res = self._cr.fetchone()
+        return res and res[0] == 'p'
+
+    @api.model
+    def _get_partition_start(self, intervals=0):
+        # Dates are stored in UTC
+        today = datetime.utcnow()
+        if self._partition_interval == 'day':
+            return datetime(today.year, today.month, today.day) + relativedelta(days=intervals)
+        return datetime(today.year, today.month, 1) + relativedelta(months=intervals)
+
+    @api.model
+    def _partition_table(self):
+        """Convert the table into a table partitioned by range on _partition_column
+
+        Existing rows are kept in a legacy partition covering all dates
+        until the end of the current interval.
+        Return True if the table is partitioned.
+        """
+        if self._is_partitioned():
+            return True
+        self._cr.execute("SHOW server_version_num")
+        if int(self._cr.fetchone()[0]) < 110000:
+            _logger.warning('PostgreSQL 11 or later is required to partition %s', self._table)
+            return False
+        table, column = self._table, self._partition_column
+        legacy_table = '%s_legacy' % table
+        self._cr.execute("""SELECT indexname, indexdef FROM pg_indexes
+            WHERE tablename = %s AND indexname != %s""", (table, '%s_pkey' % table))
+        indexes = self._cr.fetchall()
+        # Foreign keys are not copied by CREATE TABLE LIKE
+        self._cr.execute("""SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'""", (table,))
+        foreign_keys = self._cr.fetchall()
+        self._cr.execute('ALTER TABLE "%s" RENAME TO "%s"' % (table, legacy_table))
+        for indexname, _indexdef in indexes + [('%s_pkey' % table, None)]:
+            self._cr.execute('ALTER INDEX "%s" RENAME TO "%s"' % (indexname, indexname.replace(table, legacy_table, 1)))
+        for conname, _condef in foreign_keys:
+            self._cr.execute('ALTER TABLE "%s" RENAME CONSTRAINT "%s" TO "%s"'
+                             % (legacy_table, conname, conname.replace(table, legacy_table, 1)))
+        self._cr.execute("UPDATE \"%s\" SET %s = '1970-01-01' WHERE %s IS NULL" % (legacy_table, column, column))
+        self._cr.execute('ALTER TABLE "%s" ALTER COLUMN %s SET NOT NULL' % (legacy_table, column))
+        self._cr.execute('CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                         'PARTITION BY RANGE (%s)' % (table, legacy_table, column))
+        self._cr.execute('ALTER SEQUENCE "%s_id_seq" OWNED BY "%s".id' % (table, table))
+        self._cr.execute('ALTER TABLE "%s" ADD PRIMARY KEY (id, %s)' % (table, column))
+        for _indexname, indexdef in indexes:
+            self._cr.execute(indexdef)
+        for conname, condef in foreign_keys:
+            self._cr.execute('ALTER TABLE "%s" ADD CONSTRAINT "%s" %s' % (table, conname, condef))
+        upper_bound = fields.Datetime.to_string(self._get_partition_start(1))
+        self._cr.execute('ALTER TABLE "%s" ATTACH PARTITION "%s" FOR VALUES FROM (MINVALUE) TO (%%s)'
+                         % (table, legacy_table), (upper_bound,))
+        self._cr.execute('CREATE TABLE "%s_default" PARTITION OF "%s" DEFAULT' % (table, table))
+        _logger.info('Table %s is now partitioned by %s', table, self._partition_interval)
+        return True
+
+    @api.model
+    def _get_partitions(self):
+        """Return [(partition name, upper bound)] ordered by upper bound, without default partition"""
+        self._cr.execute("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s""", (self._table,))
+        partitions = []
+        for partition, bound in self._cr.fetchall():
+            match = re.search(r"TO \('([^']+)'\)", bound)
+            if match:
+                partitions.append((partition, fields.Datetime.from_string(match.group(1)[:19])))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    @api.model
+    def _get_default_partition(self):
+        """Return the name of the default partition, or None"""
+        self._cr.execute("""SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s AND pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT'""", (self._table,))
+        res = self._cr.fetchone()
+        return res and res[0]
+
+    @api.model
+    def _create_partition(self, partition, start, stop):
+        """Create partition for [start, stop[, moving its rows out of the default partition
+
+        PostgreSQL refuses to create a partition for rows stored in the default partition,
+        e.g. after a missed cron or a backfill, so the default partition is detached meanwhile.
+        """
+        column = self._partition_column
+        bounds = (fields.Datetime.to_string(start), fields.Datetime.to_string(stop))
+        where = '"%s" >= %%s AND "%s" < %%s' % (column, column)
+        default_partition = self._get_default_partition()
+        if default_partition:
+            self._cr.execute('SELECT 1 FROM "%s" WHERE %s LIMIT 1' % (default_partition, where), bounds)
+            if not self._cr.rowcount:
+                default_partition = None
+        if default_partition:
+            self._cr.execute('ALTER TABLE "%s" DETACH PARTITION "%s"' % (self._table, default_partition))
+        self._cr.execute('CREATE TABLE IF NOT EXISTS "%s" PARTITION OF "%s" FOR VALUES FROM (%%s) TO (%%s)'
+                         % (partition, self._table), bounds)
+        if default_partition:
+            self._cr.execute('WITH moved AS (DELETE FROM "%s" WHERE %s RETURNING *) INSERT INTO "%s" SELECT * FROM moved'
+                             % (default_partition, where, partition), bounds)
+            _logger.info('%s rows moved from %s to %s', self._cr.rowcount, default_partition, partition)
+            self._cr.execute('ALTER TABLE "%s" ATTACH PARTITION "%s" DEFAULT' % (self._table, default_partition))
+
+    @api.model
+    def manage_partitions(self, intervals_ahead=2):
+        """Create partitions up to intervals_ahead months or days"""
+        if not self._is_partitioned():
+            return False
+        partitions = self._get_partitions()
+        start = partitions[-1][1] if partitions else self._get_partition_start()
+        end = self._get_partition_start(intervals_ahead + 1)
+        delta, suffix = (relativedelta(days=1), '%Y%m%d') if self._partition_interval == 'day' else \
+            (relativedelta(months=1), '%Y%m')
+        while start < end:
+            stop = start + delta
+            self._create_partition('%s_%s' % (self._table, start.strftime(suffix)), start, stop)
+            start = stop
+        return True
@@ -47,6 +47,7 @@ Features
         # Check code quality with flake8
         # Count lines of code with cloc
         # Create new database with demo or Restore dump in XML/RPC
+        # Run quality check, lines count and database creation concurrently, and store duration of each stage
         # Install modules in XML/RPC
         # Let Docker containers run until new builds kill it (set max_running to limit concurrent running builds)
     # Attach log / config / tests result / code coverage files to build
@@ -79,6 +80,7 @@ Suggestions & Feedback to: corentin.pouhet-brunerie@smile.fr & isabelle.richard@
         "views/ci_badges.xml",
         "views/scm_repository_branch_build_log_view.xml",
         "views/scm_repository_branch_build_coverage_view.xml",
+        "views/scm_repository_branch_build_stage_view.xml",
         "views/scm_repository_branch_build_view.xml",
         "views/scm_repository_branch_view.xml",
         "views/scm_dashboard.xml",
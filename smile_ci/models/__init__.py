@@ -10,6 +10,7 @@ import scm_repository_branch
 import scm_repository_branch_build
 import scm_repository_branch_build_log
 import scm_repository_branch_build_coverage
+import scm_repository_branch_build_stage
 import scm_repository_branch_dependency
 import scm_vcs
 import scm_version
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from collections import defaultdict
+from datetime import datetime, timedelta
 import logging
 import os.path
 import tempfile
@@ -90,9 +92,23 @@ class DockerHost(models.Model):
     registries_path_store = fields.Char('Registries path', required=True,
                                         default=_get_default_registries_path)
     builds_host_config = fields.Text()
+    max_testing_builds = fields.Integer('Max testing builds', default=4, required=True,
+                                        help="Maximum number of builds tested at once on this host "
+                                             "by each Odoo process, i.e. size of its pool of threads")
     stats = fields.Html("Last stats", readonly=True)
     stats_date = fields.Datetime("Stats date", readonly=True)
     stats_containers = fields.Integer("Running containers", readonly=True)
+    stats_cpu_percent = fields.Float("CPU %", digits=(5, 2), readonly=True)
+    stats_mem_percent = fields.Float("MEM %", digits=(5, 2), readonly=True)
+    max_queued_builds = fields.Integer('Max queued builds', default=0,
+                                       help="Maximum number of builds pending or testing on this host, "
+                                            "all Odoo processes included, new builds are placed on other hosts "
+                                            "beyond this number. 0 means unlimited")
+    max_running_builds = fields.Integer('Max running builds', default=0, help="0 means unlimited")
+    max_cpu_percent = fields.Float('Max CPU %', digits=(5, 2), default=90.0,
+                                   help="New builds are placed on other hosts beyond this CPU usage")
+    max_mem_percent = fields.Float('Max MEM %', digits=(5, 2), default=90.0,
+                                   help="New builds are placed on other hosts beyond this memory usage")
 
     @api.model
     def _check_path(self, dirpath):
@@ -108,19 +124,57 @@ class DockerHost(models.Model):
     def registries_path(self):
         return self._check_path(self.registries_path_store)
 
+    @api.model
+    def _get_builds_count_by_host(self):
+        """Return {docker_host_id: {state: builds count}} for pending, testing and running builds"""
+        self._cr.execute("""SELECT docker_host_id, state, count(*) FROM scm_repository_branch_build
+            WHERE state IN ('pending', 'testing', 'running') GROUP BY docker_host_id, state""")
+        counts = defaultdict(lambda: defaultdict(int))
+        for docker_host_id, state, count in self._cr.fetchall():
+            counts[docker_host_id][state] = count
+        return counts
+
+    @api.multi
+    def _get_load(self, counts):
+        """Return (is_full, load) of the host, load being the sum of usage ratios
+        of queued slots, running slots, CPU and memory, from counts and cached stats
+        """
+        self.ensure_one()
+        ratios = []
+        is_full = False
+        if self.max_queued_builds:
+            ratios.append(float(counts['pending'] + counts['testing']) / self.max_queued_builds)
+            is_full |= ratios[-1] >= 1.0
+        if self.max_running_builds:
+            ratios.append(float(counts['running']) / self.max_running_builds)
+            is_full |= ratios[-1] >= 1.0
+        stats_validity = int(self.env['ir.config_parameter'].get_param('ci.docker_host_stats_validity', 600))
+        if self.stats_date and fields.Datetime.from_string(self.stats_date) >= \
+                datetime.utcnow() - timedelta(seconds=stats_validity):
+            ratios.append(self.stats_cpu_percent / 100.0)
+            ratios.append(self.stats_mem_percent / 100.0)
+            is_full |= self.stats_cpu_percent >= self.max_cpu_percent or \
+                self.stats_mem_percent >= self.max_mem_percent
+        return is_full, sum(ratios)
+
     @api.model
     def get_default_docker_host(self):
+        """Return the least loaded docker host, preferably not full, by sequence if equal
+
+        Decision is taken from builds counts and stats cached by update_stats
+        and docker.host.stats.compute_stats, without calling Docker.
+        """
         docker_hosts = self.search([])
         if not docker_hosts:
             raise UserError(_('No docker host is configured'))
-        default_docker_host = docker_hosts[0]
-        if len(docker_hosts) > 1:
-            min_containers_nb = len(default_docker_host.get_containers())
-            for docker_host in docker_hosts[1:]:
-                containers_nb = len(docker_host.get_containers())
-                if containers_nb < min_containers_nb:
-                    default_docker_host = docker_host
-        return default_docker_host
+        if len(docker_hosts) == 1:
+            return docker_hosts
+        counts = self._get_builds_count_by_host()
+        loads = []
+        for index, docker_host in enumerate(docker_hosts):
+            is_full, load = docker_host._get_load(counts[docker_host.id])
+            loads.append((is_full, load, index, docker_host))
+        return min(loads)[3]
 
     _clients = {}
 
@@ -375,19 +429,24 @@ class DockerHost(models.Model):
     def update_stats(self):
         self.ensure_one()
         data = {}
+        cpu_percent = mem_usage = 0.0
         containers = self.get_containers()
         container_names = map(lambda cont: cont['Names'][0].replace('/', ''), containers)
         for container in container_names:
             stats_gen = self.get_container_stats(container, decode=True)
             pre_stats = stats_gen.next()
             stats = stats_gen.next()
+            container_cpu_percent = (stats['cpu_stats']['cpu_usage']['total_usage'] -
+                                     pre_stats['cpu_stats']['cpu_usage']['total_usage']) * 100.0 / \
+                (stats['cpu_stats']['system_cpu_usage'] - pre_stats['cpu_stats']['system_cpu_usage'])
+            container_mem_percent = stats['memory_stats']['usage'] * 100.0 / stats['memory_stats']['limit']
+            cpu_percent += container_cpu_percent
+            mem_usage += stats['memory_stats']['usage']
             data[container] = [
-                '%.2f %%' % ((stats['cpu_stats']['cpu_usage']['total_usage'] -
-                              pre_stats['cpu_stats']['cpu_usage']['total_usage']) * 100.0 /
-                             (stats['cpu_stats']['system_cpu_usage'] - pre_stats['cpu_stats']['system_cpu_usage'])),
+                '%.2f %%' % container_cpu_percent,
                 '%s / %s' % (b2human(stats['memory_stats']['usage']),
                              b2human(stats['memory_stats']['limit'])),
-                '%.2f %%' % (stats['memory_stats']['usage'] * 100.0 / stats['memory_stats']['limit']),
+                '%.2f %%' % container_mem_percent,
                 '%.2f %%' % (stats['memory_stats']['max_usage'] * 100.0 / stats['memory_stats']['limit']),
                 '%s / %s' % (b2human(sum(network['rx_bytes'] for network in stats['networks'].itervalues())),
                              b2human(sum(network['tx_bytes'] for network in stats['networks'].itervalues()))),
@@ -408,10 +467,25 @@ class DockerHost(models.Model):
             tbody += '<tr><td>%s</td>%s</tr>' \
                 % (container, ''.join(map(lambda value: '<td>%s</td>' % value, data[container])))
         self.stats = '<table class="o_list_view table table-condensed table-striped">%s%s</table>' % (thead, tbody)
-        self.stats_containers = len(container_names)
-        self.stats_date = fields.Datetime.now()
+        self._set_load_stats(len(container_names), cpu_percent, self._get_mem_percent(mem_usage))
         return True
 
+    @api.multi
+    def _get_mem_percent(self, mem_usage):
+        """Return memory usage of containers, in bytes, as a percentage of the host memory"""
+        self.ensure_one()
+        return mem_usage * 100.0 / self.client.info()['MemTotal']
+
+    @api.multi
+    def _set_load_stats(self, containers, cpu_percent, mem_percent):
+        """Cache load of the host, used to place new builds"""
+        self.write({
+            'stats_containers': containers,
+            'stats_cpu_percent': cpu_percent,
+            'stats_mem_percent': mem_percent,
+            'stats_date': fields.Datetime.now(),
+        })
+
     @api.multi
     def show_current_stats(self):
         self.update_stats()
@@ -140,6 +140,8 @@ class Branch(models.Model):
     test_path = fields.Text('Addons path to test', help="Exclusively run tests of modules defined inside these paths.\n"
                                                         "If empty, all modules installed will be tested.")
     workers = fields.Integer('Workers', default=0, required=True)
+    build_priority = fields.Integer('Builds priority', default=0, required=True,
+                                    help="Pending builds with higher priority are tested first")
     user_uid = fields.Integer('Admin id', default=1, required=True)
     user_passwd = fields.Char('Admin password', default='admin', required=True)
     lang = fields.Selection('_get_lang', 'Language', default='en_US', required=True)
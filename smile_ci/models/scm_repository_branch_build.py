@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import base64
+from collections import defaultdict
+from contextlib import closing
 import cStringIO
 import csv
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from distutils.version import LooseVersion
 from functools import partial, wraps
+import gzip
+import hashlib
 import inspect
 import logging
 from lxml import etree
 import os
 import re
 import shutil
-import StringIO
+import socket
 import tarfile
+import tempfile
 from threading import Lock, Thread
 import time
 import xmlrpclib
@@ -28,7 +33,8 @@ from odoo.tools.safe_eval import safe_eval
 
 from odoo.addons.smile_scm.tools import cd, check_output_chain
 
-from ..tools import with_new_cursor, s2human, mergetree, get_exception_message
+from ..tools import with_new_cursor, s2human, mergetree, get_exception_message, copy_rows, BuildExecutor, \
+    run_pipeline, wait_until, LeaseLost
 
 _logger = logging.getLogger(__name__)
 
@@ -65,6 +71,10 @@ LOGFILE = 'server.log'
 TESTFILE = 'scm.repository.branch.build.log.csv'
 TEST_MODULE = 'smile_test'
 TODO_ERROR_CODE = 'T000'
+ARTIFACT_CHUNK_SIZE = 1024 * 1024
+SCHEDULER_LOCK_ID = 1413628002  # Advisory lock shared by Odoo nodes
+LOG_COLUMNS = ['type', 'result', 'module', 'file', 'line', 'code', 'exception', 'duration']
+COVERAGE_COLUMNS = ['module', 'file', 'line_count', 'line_rate', 'branch_count', 'branch_rate']
 
 
 def state_cleaner(setup_models):
@@ -77,7 +87,7 @@ def state_cleaner(setup_models):
         uid = SUPERUSER_ID
         env = api.Environment(cr, uid, {})
         try:
-            _logger.info("Cleaning testing/running builds before restarting")
+            _logger.info("Cleaning running builds before restarting")
             if 'docker.host' in env.registry.models:
                 DockerHost = env['docker.host']
                 cr.execute("select relname from pg_class where relname='%s'" % DockerHost._table)
@@ -92,14 +102,7 @@ def state_cleaner(setup_models):
                 Build = env['scm.repository.branch.build']
                 cr.execute("select relname from pg_class where relname='%s'" % Build._table)
                 if cr.rowcount:
-                    # Search testing builds
-                    builds = Build.search([('state', '=', 'testing')])
-                    branches_to_force = builds.mapped('branch_id')
-                    if builds:
-                        # Kill invalid builds
-                        _logger.debug('Killing testing builds %s' % str(builds.ids))
-                        builds._stop_container()
-                        builds.write({'state': 'done', 'result': 'killed'})
+                    # Testing builds are not killed anymore: their leases expire and they are requeued
                     # Search running builds not running anymore
                     runnning_builds = Build.search([('state', '=', 'running')])
                     actual_runnning_builds = runnning_builds.browse()
@@ -114,11 +117,6 @@ def state_cleaner(setup_models):
                         _logger.debug('Killing running builds %s' % str(builds.ids))
                         builds._stop_container()
                         builds.write({'state': 'done'})
-                    # Force build creation for branch in test before server stop
-                    if branches_to_force:
-                        _logger.debug('Force build creation for branches %s' % str(branches_to_force.ids))
-                        thread = Thread(target=branches_to_force.create_builds, args=(True,))
-                        thread.start()
         except Exception, e:
             _logger.error(get_exception_message(e))
         return res
@@ -252,6 +250,7 @@ class Build(models.Model):
     last_build_time_human = fields.Char('Last build time', compute='_get_last_build_time_human', store=False)
     log_ids = fields.One2many('scm.repository.branch.build.log', 'build_id', 'Logs', readonly=True)
     coverage_ids = fields.One2many('scm.repository.branch.build.coverage', 'build_id', 'Coverage', readonly=True)
+    stage_ids = fields.One2many('scm.repository.branch.build.stage', 'build_id', 'Stages', readonly=True)
     quality_code_count = fields.Integer('# Quality errors', readonly=True, group_operator='avg')
     failed_test_count = fields.Integer('# Failed tests', readonly=True, group_operator='avg')
     test_count = fields.Integer('# Tests', readonly=True, group_operator='avg')
@@ -260,6 +259,12 @@ class Build(models.Model):
     ppid = fields.Integer('Launcher Process Id', readonly=True)
     is_to_keep = fields.Boolean("Keep alive", readonly=True, help="If checked, this build will not be stopped by scheduler")
     is_killable = fields.Boolean("Can be killed", readonly=True, help="A build can only be killed if its container is started")
+    priority = fields.Integer(related='branch_id.build_priority', store=True, readonly=True)
+    lease_owner = fields.Char(readonly=True, help="Odoo process testing the build")
+    lease_expiration = fields.Datetime(readonly=True,
+                                       help="Without heartbeat before this date, the build is requeued")
+    heartbeat_date = fields.Datetime('Last heartbeat', readonly=True)
+    attempt_count = fields.Integer('Attempts', readonly=True)
     server_logs = fields.Text(compute='_get_last_server_logs', context={'limit': 30})
     is_last = fields.Boolean(compute='_get_is_last')
 
@@ -322,98 +327,304 @@ class Build(models.Model):
             self._scheduler()
         return True
 
+    @api.model
+    def _get_lease_owner(self):
+        return '%s:%s' % (socket.gethostname(), os.getpid())
+
+    @api.model
+    def _get_lease_expiration(self):
+        lease_duration = int(self.env['ir.config_parameter'].get_param('ci.build_lease_duration', 300))
+        return fields.Datetime.to_string(datetime.utcnow() + relativedelta(seconds=lease_duration))
+
+    @api.model
+    def _get_executor(self, docker_host):
+        lease_duration = int(self.env['ir.config_parameter'].get_param('ci.build_lease_duration', 300))
+        return BuildExecutor.get((self._cr.dbname, docker_host.id), docker_host.max_testing_builds,
+                                 self._renew_leases, heartbeat_interval=max(lease_duration / 5, 1))
+
     @api.model
     def _scheduler(self):
-        testing = self.search_count([('state', '=', 'testing')])
-        max_testing = int(self.env['ir.config_parameter'].get_param('ci.max_testing'))
-        max_testing_by_branch = int(self.env['ir.config_parameter'].get_param('ci.max_testing_by_branch'))
+        build_ids_by_docker_host, expired_build_ids = self._claim_builds()
+        # Builds are claimed in a committed transaction, before being tested in other threads.
+        # Docker is called once the scheduler lock is released, a slow host must not block other nodes.
+        self.browse(expired_build_ids)._clean_expired_builds()
+        for docker_host_id, build_ids in build_ids_by_docker_host.iteritems():
+            executor = self._get_executor(self.env['docker.host'].browse(docker_host_id))
+            for build_id in build_ids:
+                executor.submit(build_id, self.browse(build_id)._test)
+
+    @api.model
+    @with_new_cursor(False)
+    def _claim_builds(self):
+        """Requeue builds with expired leases then mark as testing pending builds,
+        by priority, within limits of the Odoo nodes and docker hosts pools
+
+        Returns ({docker_host_id: [build_id]} to test, [build_id] requeued or killed to clean).
+        Requeued builds are claimed at next run, once cleaned.
+        """
+        # Serialize scheduling between Odoo nodes, until the end of the transaction
+        self._cr.execute("SELECT pg_try_advisory_xact_lock(%s)", (SCHEDULER_LOCK_ID,))
+        if not self._cr.fetchone()[0]:
+            return {}, []
+        expired_build_ids = self._requeue_expired_builds().ids
+        get_param = self.env['ir.config_parameter'].get_param
+        max_testing = int(get_param('ci.max_testing'))
+        max_testing_by_branch = int(get_param('ci.max_testing_by_branch'))
+        builds_in_test = self.search([('state', '=', 'testing')])
+        slots = max_testing - len(builds_in_test)
+        if slots <= 0:
+            return {}, expired_build_ids
         builds_to_run = self.search([('branch_id.use_in_ci', '=', True),
                                      ('branch_id.image_to_recreate', '=', False),
-                                     ('state', '=', 'pending')], order='id asc')
-        if builds_to_run:
-            ports = sorted(self._find_ports(), reverse=True)
-            builds_in_test = self.search([('branch_id.use_in_ci', '=', True),
-                                          ('state', '=', 'testing')], order='id asc')
+                                     ('state', '=', 'pending'),
+                                     ('id', 'not in', expired_build_ids)], order='priority desc, id asc')
+        if not builds_to_run:
+            return {}, expired_build_ids
+        testing_by_branch = defaultdict(int)
+        for build in builds_in_test:
+            testing_by_branch[build.branch_id.id] += 1
+        free_slots_by_docker_host = {}
+        ports = sorted(self._find_ports(), reverse=True)
+        lease_owner = self._get_lease_owner()
+        lease_expiration = self._get_lease_expiration()
+        build_ids_by_docker_host = defaultdict(list)
         for build in builds_to_run:
+            if slots <= 0 or not ports:
+                break
             # Check max_testing_by_branch
-            builds_by_branch = [b for b in builds_in_test if b.branch_id == build.branch_id]
-            if len(builds_by_branch) >= max_testing_by_branch:
+            if testing_by_branch[build.branch_id.id] >= max_testing_by_branch:
                 continue
-            # Check max_testing
-            testing += 1
-            if testing > max_testing:
-                break
-            # Use a new cursor to avoid concurrent update if loop is longer than build test
-            build.write_with_new_cursor({
+            # Check docker host pool of this Odoo node
+            docker_host = build.docker_host_id
+            if docker_host.id not in free_slots_by_docker_host:
+                free_slots_by_docker_host[docker_host.id] = self._get_executor(docker_host).free_slots
+            if free_slots_by_docker_host[docker_host.id] <= 0:
+                continue
+            build.write({
                 'state': 'testing',
                 'result': '',
                 'date_start': fields.Datetime.now(),
                 'port': ports.pop(),
                 'ppid': os.getpid(),
+                'lease_owner': lease_owner,
+                'lease_expiration': lease_expiration,
+                'heartbeat_date': fields.Datetime.now(),
+                'attempt_count': build.attempt_count + 1,
+            })
+            testing_by_branch[build.branch_id.id] += 1
+            free_slots_by_docker_host[docker_host.id] -= 1
+            slots -= 1
+            build_ids_by_docker_host[docker_host.id].append(build.id)
+        return build_ids_by_docker_host, expired_build_ids
+
+    @api.model
+    @with_new_cursor(False)
+    def _renew_leases(self, build_ids):
+        """Heartbeat of builds tested by this process"""
+        self._cr.execute("""UPDATE scm_repository_branch_build
+            SET lease_expiration = %s, heartbeat_date = now() at time zone 'UTC'
+            WHERE id IN %s AND state = 'testing' AND lease_owner = %s RETURNING id""",
+                         (self._get_lease_expiration(), tuple(build_ids), self._get_lease_owner()))
+        lost_build_ids = set(build_ids) - set(build_id for build_id, in self._cr.fetchall())
+        if lost_build_ids:
+            # Their tests are aborted at the start of their next stage
+            _logger.warning('Leases of builds %s lost by %s' % (sorted(lost_build_ids), self._get_lease_owner()))
+        self.invalidate_cache(['lease_expiration', 'heartbeat_date'], build_ids)
+
+    @api.multi
+    def _renew_lease(self):
+        """Renew the lease of the build, locking it until the end of the transaction
+
+        Raise LeaseLost if the build is not tested by this process anymore.
+        """
+        self.ensure_one()
+        self._cr.execute("""UPDATE scm_repository_branch_build
+            SET lease_expiration = %s, heartbeat_date = now() at time zone 'UTC'
+            WHERE id = %s AND state = 'testing' AND lease_owner = %s""",
+                         (self._get_lease_expiration(), self.id, self._get_lease_owner()))
+        if not self._cr.rowcount:
+            raise LeaseLost('Build %s is not tested by %s anymore' % (self.id, self._get_lease_owner()))
+        self.invalidate_cache(['lease_expiration', 'heartbeat_date'], self.ids)
+
+    @api.multi
+    @with_new_cursor(False)
+    def _check_lease(self):
+        self._renew_lease()
+
+    @api.multi
+    @with_new_cursor(False)
+    def _write_if_leased(self, vals):
+        self._renew_lease()
+        return self.write(vals)
+
+    @api.model
+    def _requeue_expired_builds(self):
+        """Requeue testing builds whose process stopped renewing the lease, e.g. after a crash
+
+        Builds already tried ci.build_max_attempts times are killed.
+        Return requeued and killed builds, to clean with _clean_expired_builds.
+        """
+        builds = self.search([('state', '=', 'testing'), '|',
+                              ('lease_expiration', '=', False),
+                              ('lease_expiration', '<', fields.Datetime.now())])
+        if not builds:
+            return builds
+        max_attempts = int(self.env['ir.config_parameter'].get_param('ci.build_max_attempts', 3))
+        builds_to_kill = builds.filtered(lambda build: build.attempt_count >= max_attempts)
+        if builds_to_kill:
+            _logger.info('Killing builds %s after %s attempts' % (builds_to_kill.ids, max_attempts))
+            builds_to_kill.write({
+                'state': 'done',
+                'result': 'killed',
+                'date_stop': fields.Datetime.now(),
+                'error': _('Lease expired %s times') % max_attempts,
+                'lease_owner': False,
             })
-            # Use a new thread in order to launch other build tests without waiting the end of the first one
-            new_thread = Thread(target=build._test)
-            new_thread.start()
-            time.sleep(0.1)  # ?!!
+        builds_to_requeue = builds - builds_to_kill
+        if builds_to_requeue:
+            _logger.info('Requeuing builds %s with expired leases' % builds_to_requeue.ids)
+            builds_to_requeue.write({
+                'state': 'pending',
+                'result': '',
+                'port': False,
+                'is_killable': False,
+                'lease_owner': False,
+                'lease_expiration': False,
+            })
+        return builds
+
+    @api.multi
+    def _clean_expired_builds(self):
+        """Remove containers and images of builds whose lease expired"""
+        for build in self:
+            try:
+                build._remove_container()
+                build._remove_image()
+            except Exception, e:
+                _logger.error('Error while cleaning build %s: %s' % (build.id, get_exception_message(e)))
 
     @api.multi
     @with_new_cursor(False)
     def _test(self):
         self.ensure_one()
         _logger.info('Testing build %s...' % self.id)
+        leased = True
         try:
-            self._create_configfile()
-            self._create_dockerfile()
-            self._build_image()
-            self._remove_directory()
-            self._create_container()
-            self._start_container()
-            time.sleep(5)  # Ensure that Odoo is launched before calling services
-            self._check_quality_code()
-            self._count_lines_of_code()
-            self._start_coverage()
-            if self.branch_id.dump_id:
-                self._restore_db()
+            try:
+                stages = [(name, partial(self._run_stage, method), dependencies)
+                          for name, method, dependencies in self._get_stages()]
+                run_pipeline(stages, callback=self._record_stage)
+            except LeaseLost:
+                raise
+            except Exception, e:
+                msg = get_exception_message(e)
+                _logger.error(msg)
+                self._write_if_leased({
+                    'state': 'done',
+                    'result': 'failed',
+                    'date_stop': fields.Datetime.now(),
+                    'error': '...%s' % msg[-77:],
+                })
+                self.with_context(build_error=msg)._send_build_result('Failed')
+                self._remove_directory()
             else:
-                self._create_db()
-            if self.branch_id.modules_to_install:
-                modules_to_install = self.branch_id.modules_to_install.replace(' ', '').split(',')
-                if not self.branch_id.install_modules_one_by_one:
-                    modules_to_install = [modules_to_install]
-                for module in modules_to_install:
-                    if isinstance(module, basestring):
-                        module = [module]
-                    self._install_modules(module)
-                    self._run_tests()
-            else:  # E.g.: modules auto_install
-                self._run_tests()
-            self._stop_coverage()
-            self._reactivate_admin()
-        except Exception, e:
-            msg = get_exception_message(e)
-            _logger.error(msg)
-            self.write_with_new_cursor({
-                'state': 'done',
-                'result': 'failed',
-                'date_stop': fields.Datetime.now(),
-                'error': '...%s' % msg[-77:],
-            })
-            self.with_context(build_error=msg)._send_build_result('Failed')
-            self._remove_directory()
-        else:
-            self.write_with_new_cursor({'state': 'running', 'date_stop': fields.Datetime.now()})
+                self._write_if_leased({'state': 'running', 'date_stop': fields.Datetime.now()})
+        except LeaseLost, e:
+            # Another Odoo node requeued the build, leave it to the process testing it now
+            leased = False
+            _logger.warning('Test of build %s aborted: %s' % (self.id, get_exception_message(e)))
         finally:
-            self._attach_files()
-            self._load_logs_in_db()
-            self._set_build_result()
-            self._check_running()
-            if self.result == 'failed':
-                self._remove_container()
-                self._remove_image()
-            if self.docker_registry_id.active and \
-                    self.state == 'running' and self.result in ('unstable', 'stable'):
-                new_thread = Thread(target=self._store_in_registry, args=(self.result,))
-                new_thread.start()
+            if leased:
+                t0 = time.time()
+                self._attach_files()
+                self._load_logs_in_db()
+                self._record_stage('artifacts', t0, time.time() - t0)
+                self._set_build_result()
+                self._check_running()
+                if self.result == 'failed':
+                    self._remove_container()
+                    self._remove_image()
+                if self.docker_registry_id.active and \
+                        self.state == 'running' and self.result in ('unstable', 'stable'):
+                    new_thread = Thread(target=self._store_in_registry, args=(self.result,))
+                    new_thread.start()
+
+    @api.multi
+    def _get_stages(self):
+        """Return test pipeline as [(stage name, method name, dependencies names)]
+
+        A stage starts as soon as its dependencies are done,
+        concurrently with other stages, with its own cursor.
+        """
+        return [
+            ('image', '_stage_image', []),
+            ('container', '_start_container', ['image']),
+            ('quality_code', '_check_quality_code', ['container']),
+            ('cloc', '_count_lines_of_code', ['container']),
+            ('database', '_stage_database', ['container']),
+            ('tests', '_stage_tests', ['database']),
+            ('finalize', '_stage_finalize', ['quality_code', 'cloc', 'tests']),
+        ]
+
+    @api.multi
+    @with_new_cursor(False)
+    def _run_stage(self, method):
+        self.ensure_one()
+        self._check_lease()
+        getattr(self, method)()
+
+    @api.multi
+    @with_new_cursor(False)
+    def _record_stage(self, name, t0, duration, exception=None):
+        self.ensure_one()
+        _logger.info('Stage %s of build %s %s in %.3fs'
+                     % (name, self.id, 'failed' if exception else 'done', duration))
+        self.env['scm.repository.branch.build.stage'].create({
+            'build_id': self.id,
+            'name': name,
+            'date_start': fields.Datetime.to_string(datetime.utcfromtimestamp(t0)),
+            'duration': duration,
+            'result': 'error' if exception else 'success',
+            'error': exception and get_exception_message(exception)[-128:] or False,
+        })
+
+    @api.one
+    def _stage_image(self):
+        if not os.path.exists(self.directory):  # E.g. build requeued after a crash
+            self._copy_sources()
+        self._create_configfile()
+        self._create_dockerfile()
+        self._build_image()
+        self._remove_directory()
+        self._create_container()
+
+    @api.one
+    def _stage_database(self):
+        if self.branch_id.dump_id:
+            self._restore_db()
+        else:
+            self._create_db()
+
+    @api.one
+    def _stage_tests(self):
+        # Coverage is measured during tests only, not during other stages running meanwhile
+        self._start_coverage()
+        if self.branch_id.modules_to_install:
+            modules_to_install = self.branch_id.modules_to_install.replace(' ', '').split(',')
+            if not self.branch_id.install_modules_one_by_one:
+                modules_to_install = [modules_to_install]
+            for module in modules_to_install:
+                if isinstance(module, basestring):
+                    module = [module]
+                self._install_modules(module)
+                self._run_tests()
+        else:  # E.g.: modules auto_install
+            self._run_tests()
+        self._stop_coverage()
+
+    @api.one
+    def _stage_finalize(self):
+        self._reactivate_admin()
 
     @api.model
     def _check_max_running(self, domain, param):
@@ -574,17 +785,21 @@ class Build(models.Model):
 
     @api.one
     def _check_if_running(self):
-        t0 = time.time()
+        """Wait for Odoo services to answer, polling with an exponential backoff"""
         sock_db = self._connect('db')
-        while True:
-            try:
-                sock_db.server_version()
-                break
-            except:
-                if time.time() - t0 >= 60:
-                    _logger.error('Container %s exposed on port %s is not answering...'
-                                  % (self.docker_container, self.port))
-                    raise
+        sock_common = self._connect('common')
+
+        def check():
+            sock_db.server_version()
+            sock_common.version()
+
+        timeout = int(self.env['ir.config_parameter'].get_param('ci.container_start_timeout', 60))
+        try:
+            wait_until(check, timeout=timeout)
+        except:
+            _logger.error('Container %s exposed on port %s is not answering...'
+                          % (self.docker_container, self.port))
+            raise
 
     @api.model
     def _find_ports(self):
@@ -616,12 +831,13 @@ class Build(models.Model):
             sock_db.create_database(self.admin_passwd, DBNAME, branch.install_demo_data, branch.lang, branch.user_passwd)
         else:
             db_id = sock_db.create(self.admin_passwd, DBNAME, branch.install_demo_data, branch.lang, branch.user_passwd)
-            while True:
-                progress = self.sock_db.get_progress(self.admin_passwd, db_id)[0]
-                if progress == 1.0:
-                    break
-                else:
-                    time.sleep(1)
+
+            def check():
+                if sock_db.get_progress(self.admin_passwd, db_id)[0] != 1.0:
+                    raise UserError(_('Database %s is not created yet') % DBNAME)
+
+            timeout = int(self.env['ir.config_parameter'].get_param('ci.db_creation_timeout', 3600))
+            wait_until(check, timeout=timeout, max_delay=10)
 
     @api.one
     def _restore_db(self):
@@ -696,21 +912,17 @@ class Build(models.Model):
         for path in self.branch_id.addons_path.replace(' ', '').split(','):
             filename = '%s.cloc' % path.split('/')[-1]
             filepaths.append(os.path.join(self.branch_id.os_id.odoo_dir, path, filename))
+        compression = self.env['ir.config_parameter'].get_param('ci.artifacts_compression', 'none')
         missing_files = []
         for filepath in filepaths:
+            filename = os.path.basename(filepath)
             try:
                 response = self.docker_host_id.get_archive(container, filepath)
-                filelike = StringIO.StringIO(response.read())
-                tar = tarfile.open(fileobj=filelike)
-                content = tar.extractfile(os.path.basename(filepath)).read()
-                filename = os.path.basename(filepath)
-                self.env['ir.attachment'].create({
-                    'name': filename,
-                    'datas_fname': filename,
-                    'datas': base64.b64encode(content),
-                    'res_model': self._name,
-                    'res_id': self.id,
-                })
+                # Read tar as a stream, without loading it in memory
+                with closing(tarfile.open(fileobj=response, mode='r|')) as tar:
+                    member = tar.next()
+                    with closing(tar.extractfile(member)) as fileobj:
+                        self._store_artifact(fileobj, filename, compression == 'gzip')
             except APIError:
                 missing_files.append(filename)
             except Exception, e:
@@ -718,15 +930,83 @@ class Build(models.Model):
         if missing_files:
             _logger.info("The following files are missing: %s" % missing_files)
 
+    @api.multi
+    def _store_artifact(self, fileobj, filename, compress=False):
+        """Copy fileobj by chunks into the filestore and attach it to the build
+
+        As for attachments stored by Odoo, the file is named after the SHA-1
+        of its content, so an artifact identical to a previous one is not
+        stored twice. If compress, the file is stored gzipped and the
+        attachment is named filename.gz.
+        """
+        self.ensure_one()
+        Attachment = self.env['ir.attachment']
+        sha = hashlib.sha1()
+        size = 0
+        if not os.path.isdir(Attachment._filestore()):
+            os.makedirs(Attachment._filestore())
+        tmp = tempfile.NamedTemporaryFile(dir=Attachment._filestore(), delete=False)
+        try:
+            with tmp:
+                # mtime=0 so that same contents give same compressed files
+                output = gzip.GzipFile(filename, 'wb', fileobj=tmp, mtime=0) if compress else tmp
+                for chunk in iter(partial(fileobj.read, ARTIFACT_CHUNK_SIZE), ''):
+                    output.write(chunk)
+                if compress:
+                    output.close()
+            with open(tmp.name, 'rb') as f:
+                for chunk in iter(partial(f.read, ARTIFACT_CHUNK_SIZE), ''):
+                    sha.update(chunk)
+                    size += len(chunk)
+            checksum = sha.hexdigest()
+            store_fname = os.path.join(checksum[:2], checksum)
+            full_path = Attachment._full_path(store_fname)
+            if os.path.exists(full_path):
+                os.remove(tmp.name)
+            else:
+                if not os.path.isdir(os.path.dirname(full_path)):
+                    os.makedirs(os.path.dirname(full_path))
+                os.rename(tmp.name, full_path)
+        except:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+        if compress:
+            filename += '.gz'
+        attachment = Attachment.create({
+            'name': filename,
+            'datas_fname': filename,
+            'store_fname': store_fname,
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        # checksum and file_size are ignored by create, being computed from datas
+        self._cr.execute("UPDATE ir_attachment SET checksum = %s, file_size = %s WHERE id = %s",
+                         (checksum, size, attachment.id))
+        attachment.invalidate_cache(['checksum', 'file_size'], attachment.ids)
+        return attachment
+
     @api.multi
     def _get_logs(self, filename):
+        """Return the artifact filename as a file object, uncompressed if need be,
+        or None if it was not attached
+        """
         self.ensure_one()
         attachs = self.env['ir.attachment'].search([
-            ('datas_fname', '=', filename),
+            ('datas_fname', 'in', (filename, filename + '.gz')),
             ('res_model', '=', self._name),
             ('res_id', '=', self.id),
         ], limit=1)
-        return attachs and attachs[0].datas and base64.b64decode(attachs[0].datas) or ''
+        if not attachs:
+            return None
+        attach = attachs[0]
+        compressed = attach.datas_fname.endswith('.gz')
+        if attach.store_fname:
+            full_path = attach._full_path(attach.store_fname)
+            return gzip.open(full_path, 'rb') if compressed else open(full_path, 'rb')
+        # Attachment stored in database
+        fileobj = cStringIO.StringIO(base64.b64decode(attach.datas or ''))
+        return gzip.GzipFile(fileobj=fileobj, mode='rb') if compressed else fileobj
 
     @staticmethod
     def _is_flake8_error_code(code):
@@ -736,82 +1016,123 @@ class Build(models.Model):
     def _is_flake8_warning_code(code):
         return code[0] in ('W', 'C', 'N') or code in (TODO_ERROR_CODE, flake8_print.PRINT_ERROR_CODE)
 
-    @api.one
-    def _load_flake8_logs(self):
-        _logger.info('Parsing Flake8 logs for %s...' % self.docker_container)
-        data = self._get_logs(FLAKE8FILE).split('\n')
-        Log = self.env['scm.repository.branch.build.log']
+    @api.multi
+    def _bulk_create_logs(self, model, columns, rows):
+        """Insert rows of model for the build with COPY, bypassing the ORM
+
+        rows is an iterable of tuples ordered as columns, consumed by chunks
+        of ci.logs_chunk_size rows (default: 10000)
+        """
+        self.ensure_one()
+        Model = self.env[model]
+        now = fields.Datetime.now()
+        common_columns = ['build_id', 'branch_id', 'create_uid', 'create_date', 'write_uid', 'write_date']
+        common_values = (self.id, self.branch_id.id, self._uid, now, self._uid, now)
+        chunk_size = int(self.env['ir.config_parameter'].get_param('ci.logs_chunk_size', 10000))
+        count = copy_rows(self._cr, Model._table, common_columns + columns,
+                          (common_values + row for row in rows), chunk_size)
+        self.invalidate_cache(['log_ids', 'coverage_ids'], self.ids)
+        return count
+
+    @staticmethod
+    def _parse_flake8_logs(lines):
         pattern = re.compile(r'([^:]+addons/)(?P<module>[^\/]*)(/)(?P<file>[^:]+):(?P<line>\d*):(\d*): (?P<code>\w*) (?P<exception>[^$]*)')
-        for line in data:
-            m = pattern.match(line)
+        for line in lines:
+            m = pattern.match(line.rstrip('\n'))
             if m:
                 vals = m.groupdict()
-                vals['build_id'] = self.id
-                vals['type'] = 'quality_code'
                 code = vals['code']
+                # Html fields are sanitized by ORM but not by COPY
+                exception = tools.html_escape(tools.ustr(vals['exception']))
                 if Build._is_flake8_error_code(code):
-                    vals['result'] = 'error'
+                    result = 'error'
                 elif Build._is_flake8_warning_code(code):
-                    vals['result'] = 'warning'
-                Log.create(vals)
+                    result = 'warning'
+                else:
+                    continue
+                yield ('quality_code', result, vals['module'], vals['file'], vals['line'] or None,
+                       code, exception, None)
 
     @api.one
-    def _load_test_logs(self):
-        _logger.info('Importing test logs for %s...' % self.docker_container)
-        Log = self.env['scm.repository.branch.build.log']
+    def _load_flake8_logs(self):
+        _logger.info('Parsing Flake8 logs for %s...' % self.docker_container)
+        fileobj = self._get_logs(FLAKE8FILE)
+        if not fileobj:
+            return
+        with closing(fileobj):
+            self._bulk_create_logs('scm.repository.branch.build.log', LOG_COLUMNS, Build._parse_flake8_logs(fileobj))
+
+    @staticmethod
+    def _parse_test_logs(fileobj):
         pattern = re.compile(r'([^:]+addons/)(?P<file>[^$]*)')
-        csv_input = cStringIO.StringIO(self._get_logs(TESTFILE))
-        reader = csv.DictReader(csv_input)
-        for vals in reader:
+        for vals in csv.DictReader(fileobj):
             filepath = vals['file']
             if filepath:
                 match = pattern.match(filepath)
                 if match:
-                    vals['file'] = match.groupdict()['file']
-            vals['build_id'] = self.id
-            vals['code'] = 'TEST'
-            vals['type'] = 'test'
-            vals['exception'] = tools.plaintext2html(vals['exception'])
-            Log.create(vals)
+                    filepath = match.groupdict()['file']
+            yield ('test', vals['result'], vals['module'], filepath, vals['line'] or None,
+                   'TEST', tools.plaintext2html(vals['exception']), vals['duration'] or None)
 
     @api.one
-    def _load_coverage_logs(self):
-        _logger.info('Parsing coverage logs for %s...' % self.docker_container)
-        Coverage = self.env['scm.repository.branch.build.coverage']
-        pattern = re.compile(r'([^:]+addons/)(?P<module>[^\/]*)(/)(?P<file>[^$]*)')
-        logs = self._get_logs(COVERAGEFILE)
-        if not logs:
+    def _load_test_logs(self):
+        _logger.info('Importing test logs for %s...' % self.docker_container)
+        fileobj = self._get_logs(TESTFILE)
+        if not fileobj:
             return
-        root = etree.fromstring(logs)
-        for cls in root.xpath('//class'):
-            vals = {}
+        with closing(fileobj):
+            self._bulk_create_logs('scm.repository.branch.build.log', LOG_COLUMNS, Build._parse_test_logs(fileobj))
+
+    @staticmethod
+    def _parse_coverage_logs(fileobj):
+        pattern = re.compile(r'([^:]+addons/)(?P<module>[^\/]*)(/)(?P<file>[^$]*)')
+        for _event, cls in etree.iterparse(fileobj, tag='class'):
             cls_info = dict(cls.items())
             match = pattern.match(cls_info['filename'])
-            if not match:
-                continue  # native code ignored
-            infos = match.groupdict()
-            vals['build_id'] = self.id
-            vals['module'] = infos['module']
-            vals['file'] = infos['file']
-            vals['line_count'] = len(cls.find('lines').getchildren())
-            vals['line_rate'] = float(cls_info['line-rate']) * 100
-            vals['branch_count'] = len([c for c in cls.find('lines').getchildren() if dict(c.items()).get('branch')])
-            vals['branch_rate'] = float(cls_info['branch-rate']) * 100
-            Coverage.create(vals)
+            if match:  # native code ignored
+                infos = match.groupdict()
+                lines = cls.find('lines').getchildren()
+                yield (infos['module'], infos['file'],
+                       len(lines), float(cls_info['line-rate']) * 100,
+                       len([c for c in lines if dict(c.items()).get('branch')]),
+                       float(cls_info['branch-rate']) * 100)
+            # Free memory as parsing goes along
+            cls.clear()
+            while cls.getprevious() is not None:
+                del cls.getparent()[0]
+
+    @api.one
+    def _load_coverage_logs(self):
+        _logger.info('Parsing coverage logs for %s...' % self.docker_container)
+        fileobj = self._get_logs(COVERAGEFILE)
+        if not fileobj:
+            return
+        with closing(fileobj):
+            self._bulk_create_logs('scm.repository.branch.build.coverage', COVERAGE_COLUMNS,
+                                   Build._parse_coverage_logs(fileobj))
 
     @api.one
     def _set_build_result(self):
         if self.result in ('failed', 'killed'):
             return
         _logger.info('Getting the result for %s...' % self.docker_container)
-        lines_count = sum([coverage.line_count for coverage in self.coverage_ids])
-        covered_lines_count = sum([coverage.line_rate * coverage.line_count for coverage in self.coverage_ids])
+        # Count in database rather than browsing thousands of logs
+        self._cr.execute("""SELECT
+            count(*) FILTER (WHERE type = 'quality_code' AND result = 'error'),
+            count(*) FILTER (WHERE type = 'test' AND result = 'error'),
+            count(*) FILTER (WHERE type = 'test' AND result != 'ignored'),
+            count(*) FILTER (WHERE result = 'error')
+            FROM scm_repository_branch_build_log WHERE build_id = %s""", (self.id,))
+        quality_code_count, failed_test_count, test_count, error_count = self._cr.fetchone()
+        self._cr.execute("""SELECT sum(line_count), sum(line_rate * line_count)::float
+            FROM scm_repository_branch_build_coverage WHERE build_id = %s""", (self.id,))
+        lines_count, covered_lines_count = self._cr.fetchone()
         self.write({
-            'quality_code_count': len(self.log_ids.filtered(lambda log: log.type == 'quality_code' and log.result == 'error')),
-            'failed_test_count': len(self.log_ids.filtered(lambda log: log.type == 'test' and log.result == 'error')),
-            'test_count': len(self.log_ids.filtered(lambda log: log.type == 'test' and log.result != 'ignored')),
+            'quality_code_count': quality_code_count,
+            'failed_test_count': failed_test_count,
+            'test_count': test_count,
             'coverage_avg': lines_count and covered_lines_count / lines_count or 0.0,
-            'result': self.log_ids.filtered(lambda log: log.result == 'error') and 'unstable' or 'stable',
+            'result': error_count and 'unstable' or 'stable',
         })
         if self.result == 'stable':
             for previous_build in self.branch_id.build_ids:
@@ -930,6 +1251,7 @@ class Build(models.Model):
         _logger.info('Purging logs created before %s...' % (date,))
         self.env['scm.repository.branch.build.log'].purge(date)
         self.env['scm.repository.branch.build.coverage'].purge(date)
+        self.env['scm.repository.branch.build.stage'].purge(date)
         return True
 
     @api.model
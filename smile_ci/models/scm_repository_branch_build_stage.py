@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+
+class Stage(models.Model):
+    _name = 'scm.repository.branch.build.stage'
+    _description = 'Build Stage'
+    _order = 'build_id desc, date_start, id'
+
+    build_id = fields.Many2one('scm.repository.branch.build', 'Build', readonly=True, required=True,
+                               index=True, ondelete='cascade')
+    branch_id = fields.Many2one('scm.repository.branch', related='build_id.branch_id', readonly=True, store=True)
+    name = fields.Char('Stage', readonly=True, required=True)
+    date_start = fields.Datetime('Start date', readonly=True)
+    duration = fields.Float('Duration', digits=(7, 3), help='In seconds', readonly=True, group_operator='avg')
+    result = fields.Selection([
+        ('success', 'Success'),
+        ('error', 'Error'),
+    ], readonly=True)
+    error = fields.Char(readonly=True)
+
+    @api.model
+    def _get_stages_to_purge(self, date):
+        return self.search([('create_date', '<=', date)])
+
+    @api.model
+    def purge(self, date):
+        stages = self._get_stages_to_purge(date)
+        return stages.unlink()
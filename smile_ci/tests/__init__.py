@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 import test_build
+import test_executor
+import test_pipeline
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+from odoo import fields
 from odoo.tests.common import TransactionCase
 
-from ..tools import cursor
+from ..tools import cursor, LeaseLost
 
 
 class TestBuild(TransactionCase):
@@ -37,3 +41,60 @@ class TestBuild(TransactionCase):
         with cursor(self.cr.dbname, False) as new_cr:
             build = self.branch.with_env(self.env(cr=new_cr)).build_ids[0]
             self.assertEqual(build.state, 'testing', "Build not testing")
+
+    def test_030_parse_flake8_logs(self):
+        """
+            1. I parse flake8 logs
+            2. I check errors and warnings are parsed and unknown codes ignored
+        """
+        Build = self.env['scm.repository.branch.build']
+        lines = [
+            '/usr/src/odoo/addons/smile_ci/models/build.py:10:1: F401 \'os\' imported but unused',
+            '/usr/src/odoo/addons/smile_ci/models/build.py:20:80: W291 trailing whitespace',
+            '/usr/src/odoo/addons/smile_ci/models/build.py:30:1: X100 unknown code',
+            'not a flake8 log',
+        ]
+        rows = list(Build._parse_flake8_logs(lines))
+        self.assertEqual(len(rows), 2, "Flake8 logs not parsed")
+        self.assertEqual(rows[0][:6], ('quality_code', 'error', 'smile_ci', 'models/build.py', '10', 'F401'))
+        self.assertEqual(rows[1][1], 'warning', "Warning not detected")
+
+    def _get_testing_build(self, **vals):
+        build = self.branch.build_ids[0]
+        build.write(dict({
+            'state': 'testing',
+            'lease_owner': build._get_lease_owner(),
+            'lease_expiration': fields.Datetime.to_string(datetime.utcnow() - relativedelta(minutes=1)),
+            'attempt_count': 1,
+        }, **vals))
+        return build
+
+    def test_040_renew_lease(self):
+        """
+            1. I renew the expired lease of a build tested by this process
+            2. I check its lease is extended
+            3. I give the lease to another process
+            4. I check renewing the lease fails
+        """
+        build = self._get_testing_build()
+        build._renew_lease()
+        self.assertGreater(build.lease_expiration, fields.Datetime.now(), "Lease not renewed")
+        build.write({'lease_owner': 'other-node:1'})
+        with self.assertRaises(LeaseLost):
+            build._renew_lease()
+
+    def test_050_requeue_expired_builds(self):
+        """
+            1. I requeue builds with expired leases
+            2. I check a build tried once is pending again, without lease
+            3. I check a build tried ci.build_max_attempts times is killed
+        """
+        Build = self.env['scm.repository.branch.build']
+        build = self._get_testing_build()
+        self.assertIn(build, Build._requeue_expired_builds(), "Requeued build not returned to be cleaned")
+        self.assertEqual(build.state, 'pending', "Build not requeued")
+        self.assertFalse(build.lease_owner, "Lease not released")
+        max_attempts = int(self.env['ir.config_parameter'].get_param('ci.build_max_attempts', 3))
+        build = self._get_testing_build(attempt_count=max_attempts)
+        Build._requeue_expired_builds()
+        self.assertEqual((build.state, build.result), ('done', 'killed'), "Build not killed")
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from threading import Event
+
+from odoo.tests.common import TransactionCase
+
+from ..tools import BuildExecutor, wait_until
+
+
+class TestBuildExecutor(TransactionCase):
+
+    def setUp(self):
+        super(TestBuildExecutor, self).setUp()
+        self.heartbeats = []
+        self.event = Event()
+        self.addCleanup(self.event.set)
+
+    def _heartbeat(self, keys):
+        self.heartbeats.append(sorted(keys))
+
+    def _check_no_task(self, executor):
+        assert not executor.keys, 'Tasks still running'
+
+    def test_010_free_slots(self):
+        """
+            1. I submit to a pool of 2 threads 3 tasks waiting for an event
+            2. I check queued tasks take slots too
+            3. I set the event
+            4. I check slots are freed once tasks are done
+        """
+        executor = BuildExecutor(2, self._heartbeat, heartbeat_interval=60)
+        self.assertEqual(executor.free_slots, 2)
+        for key in range(3):
+            executor.submit(key, self.event.wait)
+        self.assertEqual(executor.keys, {0, 1, 2})
+        self.assertEqual(executor.free_slots, 0, "Queued tasks do not take slots")
+        self.event.set()
+        wait_until(lambda: self._check_no_task(executor), timeout=10)
+        self.assertEqual(executor.free_slots, 2, "Slots not freed")
+
+    def test_020_failed_task_frees_slot(self):
+        """
+            1. I submit a failing task
+            2. I check its slot is freed
+        """
+        executor = BuildExecutor(1, self._heartbeat, heartbeat_interval=60)
+        executor.submit('failing', lambda: 1 / 0)
+        wait_until(lambda: self._check_no_task(executor), timeout=10)
+        self.assertEqual(executor.free_slots, 1, "Slot of failed task not freed")
+
+    def test_030_heartbeat(self):
+        """
+            1. I submit a task waiting for an event, with a short heartbeat interval
+            2. I check heartbeat is called with the key of the task while it runs
+            3. I set the event
+            4. I check heartbeat is not called anymore once the task is done
+        """
+        executor = BuildExecutor(1, self._heartbeat, heartbeat_interval=0.05)
+        executor.submit(1, self.event.wait)
+
+        def check_heartbeat():
+            assert self.heartbeats, 'No heartbeat'
+        wait_until(check_heartbeat, timeout=10)
+        self.assertEqual(self.heartbeats[0], [1])
+        self.event.set()
+        wait_until(lambda: self._check_no_task(executor), timeout=10)
+
+        def check_heartbeat_thread_stopped():
+            assert not executor._heartbeat_thread, 'Heartbeat thread still alive'
+        wait_until(check_heartbeat_thread_stopped, timeout=10)
+
+    def test_040_get_executor(self):
+        """
+            1. I get the executor of a key twice, with a new size
+            2. I check the same executor is returned, resized
+        """
+        key = ('test_executor', 0)
+        executor = BuildExecutor.get(key, 1, self._heartbeat)
+        self.assertIs(BuildExecutor.get(key, 3, self._heartbeat), executor)
+        self.assertEqual(executor.free_slots, 3, "Executor not resized")
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+import time
+
+from odoo.tests.common import TransactionCase
+
+from ..tools import run_pipeline, wait_until
+
+
+class TestPipeline(TransactionCase):
+
+    def setUp(self):
+        super(TestPipeline, self).setUp()
+        self.events = []
+        self.lock = Lock()
+
+    def _stage(self, name, duration=0.0, exception=None):
+        def func():
+            with self.lock:
+                self.events.append(('start', name))
+            time.sleep(duration)
+            with self.lock:
+                self.events.append(('end', name))
+            if exception:
+                raise exception
+        return func
+
+    def test_010_dependencies_order(self):
+        """
+            1. I run a pipeline where b and c depend on a, and d on b and c
+            2. I check each stage starts after the end of its dependencies
+            3. I check b and c run concurrently
+        """
+        stages = [
+            ('d', self._stage('d'), ['b', 'c']),
+            ('b', self._stage('b', 0.2), ['a']),
+            ('c', self._stage('c', 0.2), ['a']),
+            ('a', self._stage('a'), []),
+        ]
+        results = run_pipeline(stages)
+        self.assertEqual(sorted(name for name, _t0, _duration, _exception in results), ['a', 'b', 'c', 'd'])
+        for name, _func, dependencies in stages:
+            for dependency in dependencies:
+                self.assertLess(self.events.index(('end', dependency)), self.events.index(('start', name)),
+                                "Stage %s started before the end of %s" % (name, dependency))
+        self.assertLess(self.events.index(('start', 'c')), self.events.index(('end', 'b')),
+                        "Independent stages not run concurrently")
+        self.assertLess(self.events.index(('start', 'b')), self.events.index(('end', 'c')),
+                        "Independent stages not run concurrently")
+
+    def test_020_first_error(self):
+        """
+            1. I run a pipeline where b fails quickly, c fails slowly and d depends on b
+            2. I check the error of b is raised once c is done
+            3. I check d is not started and the callback is called for each run stage
+        """
+        recorded = []
+        stages = [
+            ('a', self._stage('a'), []),
+            ('b', self._stage('b', exception=ValueError('b failed')), ['a']),
+            ('c', self._stage('c', 0.2, KeyError('c failed')), ['a']),
+            ('d', self._stage('d'), ['b']),
+        ]
+        with self.assertRaises(ValueError):
+            run_pipeline(stages, callback=lambda name, *args: recorded.append((name, args[-1])))
+        self.assertIn(('end', 'c'), self.events, "Running stage not awaited")
+        self.assertNotIn(('start', 'd'), self.events, "Stage started after a failure")
+        self.assertEqual(sorted(name for name, _exception in recorded), ['a', 'b', 'c'])
+        self.assertIsInstance(dict(recorded)['c'], KeyError)
+
+    def test_025_callback_error(self):
+        """
+            1. I run a pipeline whose callback fails at the end of a quick stage, while a slow one runs
+            2. I check the error of the callback is raised once the slow stage is done
+        """
+        def callback(name, *args):
+            if name == 'a':
+                raise KeyError('callback failed')
+        stages = [
+            ('a', self._stage('a'), []),
+            ('b', self._stage('b', 0.2), []),
+            ('c', self._stage('c'), ['a']),
+        ]
+        with self.assertRaises(KeyError):
+            run_pipeline(stages, callback=callback)
+        self.assertIn(('end', 'b'), self.events, "Running stage not awaited")
+        self.assertNotIn(('start', 'c'), self.events, "Stage started after a callback failure")
+
+    def test_030_invalid_dependencies(self):
+        """
+            1. I run a pipeline with an unknown dependency, then with circular dependencies
+            2. I check both are refused
+        """
+        with self.assertRaises(ValueError):
+            run_pipeline([('a', self._stage('a'), ['unknown'])])
+        with self.assertRaises(ValueError):
+            run_pipeline([('a', self._stage('a'), ['b']), ('b', self._stage('b'), ['a'])])
+        self.assertFalse(self.events, "Stages of invalid pipelines started")
+
+    def test_040_wait_until(self):
+        """
+            1. I wait until a check succeeds at its third call
+            2. I check its result is returned
+            3. I wait until a check which always fails, with a short timeout
+            4. I check its last exception is raised after the timeout
+        """
+        calls = []
+
+        def check():
+            calls.append(time.time())
+            if len(calls) < 3:
+                raise ValueError('not ready')
+            return 'ready'
+        self.assertEqual(wait_until(check, timeout=10, delay=0.01), 'ready')
+        self.assertEqual(len(calls), 3)
+
+        def failing_check():
+            raise KeyError('never ready')
+        t0 = time.time()
+        with self.assertRaises(KeyError):
+            wait_until(failing_check, timeout=0.2, delay=0.01)
+        self.assertGreaterEqual(time.time() - t0, 0.2, "Timeout not awaited")
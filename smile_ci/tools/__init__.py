@@ -3,5 +3,8 @@
 from api import *
 import docker_api
 from exceptions import *
+from executor import *
 from misc import *
 from osutil import *
+from pipeline import *
+from sql import *
@@ -5,6 +5,10 @@ import xmlrpclib
 from odoo import exceptions, tools
 
 
+class LeaseLost(Exception):
+    """Raised when a build is not tested by this Odoo process anymore, e.g. requeued by another node"""
+
+
 def get_exception_message(e):
     if isinstance(e, exceptions.except_orm):
         return tools.ustr(e.value or e.name)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+from Queue import Empty, Queue
+from threading import Lock, Thread
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class BuildExecutor(object):
+    """Bounded pool of threads, one pool per key (e.g. docker host) and per process
+
+    Tasks are run in submission order by at most size threads, started
+    on demand and stopped when the queue is empty. While tasks are queued
+    or running, heartbeat(keys) is called every heartbeat_interval seconds
+    from a dedicated thread, in order to renew their leases.
+    """
+
+    _executors = {}
+    _executors_lock = Lock()
+
+    @classmethod
+    def get(cls, key, size, heartbeat, heartbeat_interval=60):
+        with cls._executors_lock:
+            executor = cls._executors.get(key)
+            # Threads are not inherited by forked processes
+            if not executor or executor._pid != os.getpid():
+                executor = cls._executors[key] = cls(size, heartbeat, heartbeat_interval)
+            executor.size = size
+            executor._heartbeat = heartbeat
+            executor._heartbeat_interval = heartbeat_interval
+            return executor
+
+    def __init__(self, size, heartbeat, heartbeat_interval=60):
+        self.size = size
+        self._heartbeat = heartbeat
+        self._heartbeat_interval = heartbeat_interval
+        self._queue = Queue()
+        self._lock = Lock()
+        self._keys = set()
+        self._workers = 0
+        self._heartbeat_thread = None
+        self._pid = os.getpid()
+
+    @property
+    def keys(self):
+        """Keys of queued or running tasks"""
+        with self._lock:
+            return set(self._keys)
+
+    @property
+    def free_slots(self):
+        with self._lock:
+            return max(self.size - len(self._keys), 0)
+
+    def submit(self, key, func, *args):
+        with self._lock:
+            self._keys.add(key)
+            self._queue.put((key, func, args))
+            if self._workers < self.size:
+                self._workers += 1
+                self._start_thread(self._work, 'smile_ci.executor.worker')
+            if not self._heartbeat_thread or not self._heartbeat_thread.is_alive():
+                self._heartbeat_thread = self._start_thread(self._beat, 'smile_ci.executor.heartbeat')
+
+    @staticmethod
+    def _start_thread(target, name):
+        thread = Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _work(self):
+        while True:
+            try:
+                key, func, args = self._queue.get(timeout=1)
+            except Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._workers -= 1
+                        return
+                continue
+            try:
+                func(*args)
+            except Exception:
+                _logger.exception('Task %s failed', key)
+            finally:
+                with self._lock:
+                    self._keys.discard(key)
+
+    def _beat(self):
+        while True:
+            time.sleep(self._heartbeat_interval)
+            keys = self.keys
+            if not keys:
+                with self._lock:
+                    if not self._keys:
+                        self._heartbeat_thread = None
+                        return
+                continue
+            try:
+                self._heartbeat(list(keys))
+            except Exception:
+                _logger.exception('Heartbeat of tasks %s failed', sorted(keys))
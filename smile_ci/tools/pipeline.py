@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from Queue import Queue
+import sys
+from threading import Thread
+import time
+
+
+def run_pipeline(stages, callback=None):
+    """Run stages concurrently, each one as soon as its dependencies are done
+
+    stages is a list of (name, func, dependencies names). As soon as
+    a stage fails, no other stage is started: running ones are awaited
+    then the first exception is raised again.
+    callback(name, start time, duration in seconds, exception or None)
+    is called in the calling thread at the end of each stage; if it raises,
+    it is handled as a stage failure.
+    Return [(name, start time, duration, exception)] in order of completion.
+    """
+    names = [name for name, _func, _dependencies in stages]
+    for name, _func, dependencies in stages:
+        unknown = set(dependencies) - set(names)
+        if unknown:
+            raise ValueError('Stage %s depends on unknown stages %s' % (name, sorted(unknown)))
+    pending = list(stages)
+    done = set()
+    running = 0
+    results = []
+    error = None
+    queue = Queue()
+
+    def run(name, func):
+        t0 = time.time()
+        exc_info = None
+        try:
+            func()
+        except Exception:
+            exc_info = sys.exc_info()
+        queue.put((name, t0, time.time() - t0, exc_info))
+
+    while True:
+        if not error:
+            for stage in list(pending):
+                name, func, dependencies = stage
+                if set(dependencies) <= done:
+                    pending.remove(stage)
+                    thread = Thread(target=run, args=(name, func), name='smile_ci.pipeline.%s' % name)
+                    thread.start()
+                    running += 1
+        if not running:
+            break
+        name, t0, duration, exc_info = queue.get()
+        running -= 1
+        results.append((name, t0, duration, exc_info and exc_info[1]))
+        if exc_info:
+            error = error or exc_info
+        else:
+            done.add(name)
+        if callback:
+            try:
+                callback(*results[-1])
+            except Exception:
+                # Like a failed stage, running stages are awaited before raising
+                error = error or sys.exc_info()
+    if error:
+        raise error[0], error[1], error[2]
+    if pending:
+        raise ValueError('Stages %s have circular dependencies' % [stage[0] for stage in pending])
+    return results
+
+
+def wait_until(check, timeout=60, delay=0.1, max_delay=5, backoff=2):
+    """Call check until it does not raise, waiting between calls
+    from delay to max_delay seconds, with an exponential backoff
+
+    Exception raised by the last call is raised again after timeout seconds.
+    """
+    t0 = time.time()
+    while True:
+        try:
+            return check()
+        except Exception:
+            if time.time() - t0 >= timeout:
+                raise
+        time.sleep(min(delay, max(timeout - (time.time() - t0), 0)))
+        delay = min(delay * backoff, max_delay)
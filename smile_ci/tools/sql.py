@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import cStringIO
+import csv
+from itertools import islice
+
+NULL = '\\N'
+
+
+def _format_value(value):
+    if value is None or value is False:
+        return NULL
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def copy_rows(cr, table, columns, rows, chunk_size=10000):
+    """Insert rows, an iterable of tuples ordered as columns, with one COPY per chunk of rows
+
+    Only chunk_size rows are kept in memory at the same time.
+    Return the number of inserted rows.
+    """
+    query = 'COPY "%s" (%s) FROM STDIN WITH (FORMAT csv, NULL \'%s\')' \
+        % (table, ', '.join('"%s"' % column for column in columns), NULL)
+    rows = iter(rows)
+    count = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        buf = cStringIO.StringIO()
+        writer = csv.writer(buf)
+        for row in chunk:
+            writer.writerow(map(_format_value, row))
+        buf.seek(0)
+        cr.copy_expert(query, buf)
+        count += len(chunk)
+    return count
@@ -30,11 +30,14 @@ class DockerHostStats(models.TransientModel):
         for docker_host in self.env['docker.host'].search([]):
             containers = docker_host.get_containers()
             container_names = map(lambda cont: cont['Names'][0].replace('/', ''), containers)
+            host_stats = self.browse()
+            mem_usage = 0
             for container in sorted(container_names):
                 stats_gen = docker_host.get_container_stats(container, decode=True)
                 pre_stats = stats_gen.next()
                 stats = stats_gen.next()
-                self.create({
+                mem_usage += stats['memory_stats']['usage']
+                host_stats |= self.create({
                     'docker_host_id': docker_host.id,
                     'container': container,
                     'cpu_usage': (stats['cpu_stats']['cpu_usage']['total_usage'] -
@@ -48,4 +51,6 @@ class DockerHostStats(models.TransientModel):
                     'network_input': compute_MiB(sum(network['rx_bytes'] for network in stats['networks'].itervalues())),
                     'network_output': compute_MiB(sum(network['tx_bytes'] for network in stats['networks'].itervalues())),
                 })
+            docker_host._set_load_stats(len(container_names), sum(host_stats.mapped('cpu_usage')),
+                                        docker_host._get_mem_percent(mem_usage))
         return True
@@ -35,13 +35,15 @@ Notice
         import logging
         logger = SmileLogger(dbname, model_name, res_id, uid)
         logger.info(your_message) will create a log in db with a unique pid per logger
+        logger.progress(done, total) will update progress, rate and ETA of the process, without creating a log
 
 Suggestions & Feedback to: xavier.fernandez@smile.fr, corentin.pouhet-brunerie@smile.fr
 """,
-    "depends": ['base'],
+    "depends": ['smile_base'],
     "data": [
         "security/smile_log_security.xml",
         "security/ir.model.access.csv",
+        "data/ir_cron.xml",
         "views/smile_log_view.xml",
     ],
     "installable": True,
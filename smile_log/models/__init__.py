@@ -20,3 +20,4 @@
 ##############################################################################
 
 import smile_log
+import smile_log_progress
@@ -19,37 +19,61 @@
 #
 ##############################################################################
 
-import os
-import time
+from datetime import datetime, timedelta
+import logging
 
-from odoo import api, models, fields
+from odoo import api, models, fields, SUPERUSER_ID, _
+from odoo.exceptions import AccessError
+
+from ..tools.archive import archive_logs, load_archives
+
+_logger = logging.getLogger(__package__)
 
 
 class SmileLog(models.Model):
     _name = 'smile.log'
+    _inherit = ['partition.mixin']
     _description = 'Smile Logs'
     _rec_name = 'message'
     _log_access = False
     _order = 'log_date desc'
 
-    @api.one
+    @api.multi
     @api.depends('log_uid')
     def _get_user_name(self):
-        user = self.env['res.users'].browse(self.log_uid)
-        if user.exists():
-            self.log_user_name = "%s [%s]" % (user.name, self.log_uid)
-        else:
-            self.log_user_name = "[%s]" % self.log_uid
+        users = self.env['res.users'].browse(list(set(self.mapped('log_uid')))).exists()
+        names = {user.id: user.name for user in users}
+        for log in self:
+            if log.log_uid in names:
+                log.log_user_name = "%s [%s]" % (names[log.log_uid], log.log_uid)
+            else:
+                log.log_user_name = "[%s]" % log.log_uid
 
-    @api.one
+    @api.multi
     @api.depends('res_id')
     def _get_res_name(self):
-        res = self.env[self.model_name].browse(self.res_id)
-        infos = res.name_get()
-        if infos:
-            self.log_res_name = infos[0][1]
+        ids_by_model = {}
+        for log in self:
+            if log.model_name in self.env and log.res_id:
+                ids_by_model.setdefault(log.model_name, set()).add(log.res_id)
+        names = {}
+        for model_name, res_ids in ids_by_model.iteritems():
+            records = self.env[model_name].browse(list(res_ids)).exists()
+            names[model_name] = dict(records.name_get())
+        for log in self:
+            log.log_res_name = names.get(log.model_name, {}).get(log.res_id)
+
+    @api.multi
+    @api.depends('pid')
+    def _get_progress(self):
+        progress_by_pid = self.env['smile.log.progress'].get_progress_by_pid(set(self.mapped('pid')))
+        for log in self:
+            progress = progress_by_pid.get(log.pid)
+            if progress:
+                log.progress = progress['progress']
+                log.eta = progress['eta']
 
-    log_date = fields.Datetime('Date', readonly=True)
+    log_date = fields.Datetime('Date', readonly=True, index=True)
     log_uid = fields.Integer('User', readonly=True)
     log_user_name = fields.Char(string='User', size=256, compute='_get_user_name')
     log_res_name = fields.Char(string='Ressource name', size=256, compute='_get_res_name')
@@ -58,17 +82,91 @@ class SmileLog(models.Model):
     pid = fields.Integer(readonly=True, group_operator="count")
     level = fields.Char(size=16, readonly=True)
     message = fields.Text('Message', readonly=True)
+    duration = fields.Float('Duration (ms)', readonly=True, group_operator="avg")
+    exception_type = fields.Char('Exception', size=128, readonly=True)
+    stack = fields.Text('Stack', readonly=True)
+    progress = fields.Float('Progress (%)', compute='_get_progress')
+    eta = fields.Datetime('ETA', compute='_get_progress')
+
+    _partition_column = 'log_date'
+    _partition_interval = 'month'  # or 'day'
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute("CREATE SEQUENCE IF NOT EXISTS smile_log_seq")
+        if self._partition_table():
+            self.manage_partitions()
+        self._cr.execute("CREATE INDEX IF NOT EXISTS smile_log_pid_log_date_index ON smile_log (pid, log_date)")
+        self._cr.execute("""CREATE INDEX IF NOT EXISTS smile_log_model_name_res_id_log_date_index
+            ON smile_log (model_name, res_id, log_date)""")
+
+    @api.model
+    def tail(self, last_id=0, pid=None, limit=1000):
+        """Return logs created after the log last_id, of the process pid if given,
+        as a list of dicts ordered by id
+        """
+        self.check_access_rights('read')
+        query = "SELECT id, log_date, pid, level, message FROM smile_log WHERE id > %s"
+        params = [last_id]
+        if pid:
+            query += " AND pid = %s"
+            params.append(pid)
+        self._cr.execute(query + " ORDER BY id LIMIT %s", params + [limit])
+        return self._cr.dictfetchall()
+
+    @api.model
+    def _get_archive_columns(self):
+        return ['id'] + [fname for fname, field in self._fields.iteritems()
+                         if field.store and field.column_type and fname != 'id']
 
     @api.model
-    def archive_and_delete_old_logs(self, nb_days=90, archive_path=''):
-        # Thanks to transaction isolation, the COPY and DELETE will find the same smile_log records
-        if archive_path:
-            file_name = time.strftime("%Y%m%d_%H%M%S.log.csv")
-            file_path = os.path.join(archive_path, file_name)
-            self.env.cr.execute("""COPY (SELECT * FROM smile_log
-            WHERE log_date + interval'%s days' < NOW() at time zone 'UTC')
-            TO %s
-            WITH (FORMAT csv, ENCODING utf8)""", (nb_days, file_path,))
-        self.env.cr.execute("DELETE FROM smile_log WHERE log_date + interval '%s days' < NOW() at time zone 'UTC'",
-                            (nb_days,))
+    def archive_and_delete_old_logs(self, nb_days=90, archive_path='', compression='gzip'):
+        """Delete logs older than nb_days, after exporting them in archive_path if given
+
+        Archives are compressed CSV files, one per day, indexed in archive_path/manifest.json,
+        see import_archives to load them again.
+        If smile_log is partitioned, whole partitions are detached and dropped,
+        and old rows are deleted from the default partition.
+        """
+        if self._uid != SUPERUSER_ID:
+            raise AccessError(_('Only superuser can archive and delete logs!'))
+        # Log dates are stored in UTC
+        limit_date = fields.Datetime.to_string(datetime.utcnow() - timedelta(days=nb_days))
+        columns = self._get_archive_columns()
+        if not self._is_partitioned():
+            # Thanks to transaction isolation, the COPY and DELETE will find the same smile_log records
+            if archive_path:
+                archive_logs(self.env.cr, archive_path, self._table, columns, 'log_date < %s', (limit_date,),
+                             compression)
+            self.env.cr.execute("DELETE FROM smile_log WHERE log_date < %s", (limit_date,))
+            self.env.cr.execute("DELETE FROM smile_log_progress WHERE update_date < %s", (limit_date,))
+            return True
+        # Drop whole partitions instead of deleting rows
+        for partition, upper_bound in self._get_partitions():
+            if fields.Datetime.to_string(upper_bound) > limit_date:
+                break
+            if archive_path:
+                archive_logs(self.env.cr, archive_path, partition, columns, compression=compression)
+            self.env.cr.execute('ALTER TABLE "%s" DETACH PARTITION "%s"' % (self._table, partition))
+            self.env.cr.execute('DROP TABLE "%s"' % partition)
+            _logger.info('Logs partition %s dropped', partition)
+        # Rows out of all partitions, e.g. backfilled after the drop of their partition
+        default_partition = self._get_default_partition()
+        if default_partition:
+            if archive_path:
+                archive_logs(self.env.cr, archive_path, default_partition, columns, 'log_date < %s', (limit_date,),
+                             compression)
+            self.env.cr.execute('DELETE FROM "%s" WHERE log_date < %%s' % default_partition, (limit_date,))
+            if self.env.cr.rowcount:
+                _logger.info('%s old logs deleted from partition %s', self.env.cr.rowcount, default_partition)
+        self.env.cr.execute("DELETE FROM smile_log_progress WHERE update_date < %s", (limit_date,))
         return True
+
+    @api.model
+    def import_archives(self, archive_path, date_from, date_to, table='smile_log_import'):
+        """Load logs archived in archive_path between date_from and date_to into a scratch table"""
+        if self._uid != SUPERUSER_ID:
+            raise AccessError(_('Only superuser can import archived logs!'))
+        count = load_archives(self.env.cr, archive_path, date_from, date_to, table)
+        _logger.info('%s archived logs loaded into %s', count, table)
+        return count
@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2011 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from odoo import api, models, fields
+
+
+class SmileLogProgress(models.Model):
+    _name = 'smile.log.progress'
+    _description = 'Smile Logs Progress'
+    _rec_name = 'pid'
+    _log_access = False
+    _order = 'update_date desc'
+
+    pid = fields.Integer(readonly=True, required=True)
+    log_uid = fields.Integer('User', readonly=True)
+    model_name = fields.Char('Model name', size=64, readonly=True)
+    res_id = fields.Integer('Ressource id', readonly=True)
+    start_date = fields.Datetime('Start date', readonly=True)
+    update_date = fields.Datetime('Last update', readonly=True)
+    done = fields.Integer(readonly=True)
+    total = fields.Integer(readonly=True)
+    progress = fields.Float('Progress (%)', readonly=True, group_operator="avg")
+    rate = fields.Float('Rate (/s)', readonly=True, group_operator="avg")
+    eta = fields.Datetime('ETA', readonly=True)
+
+    _sql_constraints = [
+        ('pid_uniq', 'UNIQUE (pid)', 'Progress must be unique per pid'),
+    ]
+
+    @api.model
+    def get_progress_by_pid(self, pids):
+        """Return {pid: progress row as dict} without checking access rules, for smile.log views"""
+        if not pids:
+            return {}
+        self._cr.execute("SELECT pid, done, total, progress, rate, eta FROM smile_log_progress WHERE pid IN %s",
+                         (tuple(pids),))
+        return {row['pid']: row for row in self._cr.dictfetchall()}
@@ -0,0 +1,81 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2011 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from datetime import datetime
+
+import psycopg2
+
+from odoo.tests.common import TransactionCase
+
+from ..tools.db_handler import SmileDBHandler, SmileDBPool
+
+
+class TestSmileDBPool(TransactionCase):
+
+    def setUp(self):
+        super(TestSmileDBPool, self).setUp()
+        self.pool = SmileDBPool(self.cr.dbname, maxconn=1)
+        self.addCleanup(self.pool.close)
+
+    def _check_pool_usable(self):
+        with self.pool.cursor() as cr:
+            cr.execute("SELECT 1")
+            self.assertEqual(cr.fetchone()[0], 1)
+
+    def test_010_programming_error_releases_connection(self):
+        """
+            1. I execute an invalid request with a pool of one connection
+            2. I check the connection is given back to the pool
+        """
+        with self.assertRaises(psycopg2.ProgrammingError):
+            with self.pool.cursor() as cr:
+                cr.execute("SELECT * FROM smile_log_unknown_table")
+        self._check_pool_usable()
+
+    def test_020_value_error_releases_connection(self):
+        """
+            1. I insert a message containing a NUL byte with a pool of one connection
+            2. I check the connection is given back to the pool
+        """
+        with self.assertRaises(ValueError):
+            with self.pool.cursor() as cr:
+                cr.execute("SELECT %s", ('NUL \x00 byte',))
+        self._check_pool_usable()
+
+    def test_030_log_after_error(self):
+        """
+            1. I insert a log containing a NUL byte
+            2. I check a next log is inserted
+        """
+        handler = SmileDBHandler()
+        dbname = self.cr.dbname
+        message = 'smile_log test %s' % id(handler)
+        row = [datetime.utcnow(), self.uid, 'res.users', self.uid, 0, 'INFO', message, None, None, None]
+        try:
+            with self.assertRaises(ValueError):
+                handler._insert(dbname, [row[:6] + ['NUL \x00 byte'] + row[7:]])
+            handler._insert(dbname, [row])
+            with handler._get_pool(dbname).cursor() as cr:
+                cr.execute("DELETE FROM smile_log WHERE message = %s", (message,))
+                self.assertEqual(cr.rowcount, 1, "Log not inserted after error")
+        finally:
+            for pool in handler._dbname_to_pool.values():
+                pool.close()
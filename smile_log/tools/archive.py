@@ -0,0 +1,213 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 Smile (<http://www.smile.fr>). All Rights Reserved
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import re
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+from odoo import fields
+
+MANIFEST = 'manifest.json'
+EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+
+@contextmanager
+def open_archive(file_path, mode='rb', compression='gzip'):
+    if compression == 'gzip':
+        archive = gzip.open(file_path, mode)
+        try:
+            yield archive
+        finally:
+            archive.close()
+    elif compression == 'zstd':
+        if not zstd:
+            raise ImportError('zstandard python library is required to handle zstd archives')
+        with open(file_path, mode) as fileobj:
+            if 'w' in mode:
+                with zstd.ZstdCompressor().stream_writer(fileobj) as archive:
+                    yield archive
+            else:
+                with zstd.ZstdDecompressor().stream_reader(fileobj) as archive:
+                    yield archive
+    else:
+        raise ValueError('Unknown compression: %s' % compression)
+
+
+class SizeCounter(object):
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+
+def read_manifest(archive_path):
+    file_path = os.path.join(archive_path, MANIFEST)
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(archive_path, manifest):
+    file_path = os.path.join(archive_path, MANIFEST)
+    with open(file_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(file_path + '.tmp', file_path)
+
+
+class DailyArchiveWriter(object):
+    """File-like object receiving COPY output in CSV, each row starting with its day
+    as YYYYMMDD, and writing rows without this day into one archive per day
+
+    Rows are expected ordered by day. Each archive is added to the manifest
+    once complete, so that the manifest stays consistent with files
+    if export is interrupted.
+    """
+
+    def __init__(self, archive_path, manifest, columns, compression='gzip'):
+        self.archive_path = archive_path
+        self.manifest = manifest
+        self.columns = columns
+        self.compression = compression
+        self.file_names = []
+        self._buffer = ''
+        self._pos = 0
+        self._quotes = 0
+        self._day = None
+        self._file_name = None
+        self._context = None
+        self._counter = None
+
+    def write(self, data):
+        self._buffer += data
+        while True:
+            index = self._buffer.find('\n', self._pos)
+            if index < 0:
+                break
+            self._quotes += self._buffer.count('"', self._pos, index)
+            self._pos = index + 1
+            # A newline inside a quoted value does not end the row
+            if self._quotes % 2 == 0:
+                row, self._buffer = self._buffer[:self._pos], self._buffer[self._pos:]
+                self._pos = self._quotes = 0
+                self._write_row(row)
+
+    def _write_row(self, row):
+        day, row = row.split(',', 1)
+        if day != self._day:
+            self._close_archive()
+            self._open_archive(day)
+        self._counter.write(row)
+
+    def _open_archive(self, day):
+        extension = EXTENSIONS[self.compression]
+        file_name = 'smile_log_%s.csv.%s' % (day, extension)
+        index = 0
+        while file_name in self.manifest or os.path.exists(os.path.join(self.archive_path, file_name)):
+            index += 1
+            file_name = 'smile_log_%s_%s.csv.%s' % (day, index, extension)
+        self._day = day
+        self._file_name = file_name
+        self._context = open_archive(os.path.join(self.archive_path, file_name), 'wb', self.compression)
+        self._counter = SizeCounter(self._context.__enter__())
+
+    def _close_archive(self, complete=True):
+        if not self._context:
+            return
+        self._context.__exit__(None, None, None)
+        self._context = None
+        if not complete:
+            return
+        start = datetime.strptime(self._day, '%Y%m%d')
+        self.manifest[self._file_name] = {
+            'start': fields.Datetime.to_string(start),
+            'end': fields.Datetime.to_string(start + timedelta(days=1)),
+            'columns': self.columns,
+            'compression': self.compression,
+            'size': self._counter.size,
+        }
+        self.file_names.append(self._file_name)
+        write_manifest(self.archive_path, self.manifest)
+
+    def close(self, complete=True):
+        self._close_archive(complete)
+
+
+def archive_logs(cr, archive_path, source, columns, where='TRUE', params=(), compression='gzip'):
+    """Export logs of source table matching where clause through a single COPY TO STDOUT,
+    into one compressed CSV file per day, indexed in manifest.json
+
+    Files are written on Odoo server, no superuser rights are required.
+    Return the list of created files.
+    """
+    writer = DailyArchiveWriter(archive_path, read_manifest(archive_path), columns, compression)
+    query = cr.mogrify('COPY (SELECT to_char(log_date, \'YYYYMMDD\'), %s FROM "%s" WHERE %s ORDER BY log_date) '
+                       'TO STDOUT WITH (FORMAT csv, ENCODING utf8)' % (', '.join(columns), source, where),
+                       tuple(params))
+    try:
+        cr.copy_expert(query, writer)
+    except Exception:
+        writer.close(complete=False)
+        raise
+    writer.close()
+    return writer.file_names
+
+
+def load_archives(cr, archive_path, date_from, date_to, table):
+    """Load archived logs between date_from and date_to into table,
+    created if needed with the same columns as smile_log
+
+    Archives are first copied into a temporary table, so that rows of previous
+    imports are kept, and logs already in table are not loaded again.
+    Return the number of loaded logs.
+    """
+    if not re.match(r'^[a-z_][a-z0-9_]*$', table) or table == 'smile_log':
+        raise ValueError('Invalid table name: %s' % table)
+    cr.execute('CREATE TABLE IF NOT EXISTS "%s" (LIKE smile_log)' % table)
+    cr.execute('CREATE TEMPORARY TABLE smile_log_archive_load (LIKE smile_log) ON COMMIT DROP')
+    manifest = read_manifest(archive_path)
+    for file_name, chunk in sorted(manifest.iteritems(), key=lambda item: item[1]['start']):
+        if chunk['start'] >= date_to or chunk['end'] <= date_from:
+            continue
+        with open_archive(os.path.join(archive_path, file_name), 'rb', chunk['compression']) as archive:
+            cr.copy_expert('COPY smile_log_archive_load (%s) FROM STDIN WITH (FORMAT csv, ENCODING utf8)'
+                           % ', '.join(chunk['columns']), archive)
+    cr.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+    columns = ', '.join('"%s"' % column for column, in cr.fetchall())
+    cr.execute("""INSERT INTO "%s" (%s) SELECT %s FROM smile_log_archive_load archive
+        WHERE log_date >= %%s AND log_date < %%s
+        AND NOT EXISTS (SELECT 1 FROM "%s" WHERE id = archive.id)""" % (table, columns, columns, table),
+               (date_from, date_to))
+    count = cr.rowcount
+    cr.execute('DROP TABLE smile_log_archive_load')
+    return count
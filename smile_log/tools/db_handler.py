@@ -19,58 +19,237 @@
 #
 ##############################################################################
 
+from contextlib import contextmanager
+from datetime import datetime
 import logging
+import os
+from Queue import Empty, Queue
+import sys
+import threading
+import time
 
-from odoo.modules.registry import RegistryManager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from odoo.sql_db import connection_info_for
+from odoo.tools import config
+
+
+class SmileDBPool(object):
+    """Autocommit connections pool dedicated to logs of a database
+
+    Connections are not taken from Odoo pool, so that logging cannot
+    exhaust db_maxconn, and their number is limited to maxconn.
+    Connections idle for more than health_check_delay seconds are
+    checked before use.
+    """
+
+    def __init__(self, dbname, maxconn=1, health_check_delay=60):
+        connection_info = connection_info_for(dbname)[1]
+        self._pool = ThreadedConnectionPool(0, maxconn, **connection_info)
+        self._semaphore = threading.BoundedSemaphore(maxconn)
+        self._health_check_delay = health_check_delay
+        self._last_use = {}
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.time() - self._last_use.get(id(conn), 0) < self._health_check_delay:
+            return True
+        try:
+            with conn.cursor() as cr:
+                cr.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _getconn(self):
+        conn = self._pool.getconn()
+        if not self._is_healthy(conn):
+            self._pool.putconn(conn, close=True)
+            conn = self._pool.getconn()
+        conn.autocommit = True
+        return conn
+
+    @contextmanager
+    def cursor(self):
+        with self._semaphore:
+            conn = self._getconn()
+            broken = False
+            try:
+                with conn.cursor() as cr:
+                    yield cr
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                # Always give back the connection, else the pool is exhausted forever
+                if broken or conn.closed:
+                    self._last_use.pop(id(conn), None)
+                    self._pool.putconn(conn, close=True)
+                else:
+                    self._last_use[id(conn)] = time.time()
+                    self._pool.putconn(conn)
+
+    def close(self):
+        self._pool.closeall()
 
 
 class SmileDBHandler(logging.Handler):
+    """Logs handler writing to smile_log table
+
+    emit only enqueues log records: a background thread inserts them
+    by batches, one multi-row INSERT per database. Following options
+    can be set in Odoo configuration file:
+    * smile_log_flush_interval: max delay in seconds before insertion (default: 1)
+    * smile_log_batch_size: max number of logs per INSERT (default: 1000)
+    * smile_log_queue_size: max number of logs waiting for insertion,
+      beyond which emit blocks (default: 100000)
+    * smile_log_maxconn: max number of connections per database (default: 1)
+
+    Progress of logger processes goes through the same queue:
+    only the last state of each pid is kept and upserted in
+    smile_log_progress.
+    """
 
     def __init__(self, level=logging.NOTSET):
         logging.Handler.__init__(self, level)
-        self._dbname_to_cr = {}
+        self._dbname_to_pool = {}
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._thread_lock = threading.Lock()
+
+    def _get_pool(self, dbname):
+        pool = self._dbname_to_pool.get(dbname)
+        if not pool:
+            with self._thread_lock:
+                pool = self._dbname_to_pool.get(dbname)
+                if not pool:
+                    pool = SmileDBPool(dbname, int(config.get('smile_log_maxconn', 1)))
+                    self._dbname_to_pool[dbname] = pool
+        return pool
 
-    def _get_cursor(self, dbname):
-        cr = self._dbname_to_cr.get(dbname)
-        if not cr or (cr and cr.closed):
-            db = RegistryManager.get(dbname)._db
-            cr = db.cursor()
-            cr.autocommit(True)
-            self._dbname_to_cr[dbname] = cr
-        return cr
+    def _get_queue(self):
+        # Start flush thread at first use, and again in forked processes
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._pid != os.getpid() or not self._thread.is_alive():
+                    self._queue = Queue(int(config.get('smile_log_queue_size', 100000)))
+                    self._dbname_to_pool = {}
+                    self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                    name='smile_log.db_handler')
+                    self._thread.daemon = True
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
 
     def emit(self, record):
         if not (record.args and isinstance(record.args, dict)):
             return False
 
         dbname = record.args.get('dbname', '')
-        cr = self._get_cursor(dbname)
-
         res_id = record.args.get('res_id', 0)
         pid = record.args.get('pid', 0)
         uid = record.args.get('uid', 0)
         model_name = record.args.get('model_name', '')
+        duration = record.args.get('duration')
+        exception_type = record.args.get('exception_type')
+        stack = record.args.get('stack')
+        log_date = datetime.utcfromtimestamp(record.created)
+
+        self._get_queue().put((dbname, 'log', (log_date, uid, model_name, res_id, pid, record.levelname,
+                                               record.msg, duration, exception_type, stack)))
+        return True
 
-        request = """INSERT INTO smile_log (log_date, log_uid, model_name, res_id, pid, level, message)
-        VALUES (now() at time zone 'UTC', %s, %s, %s, %s, %s, %s)"""
-        params = (uid, model_name, res_id, pid, record.levelname, record.msg,)
+    def progress(self, dbname, row):
+        """Enqueue a progress state of a logger process
 
+        row is (pid, log_uid, model_name, res_id, start_date, update_date,
+        done, total, progress, rate, eta)
+        """
+        self._get_queue().put((dbname, 'progress', row))
+
+    def _run(self, queue):
+        flush_interval = float(config.get('smile_log_flush_interval', 1.0))
+        batch_size = int(config.get('smile_log_batch_size', 1000))
+        stop = False
+        while not stop:
+            rows_by_dbname = {}
+            progress_by_dbname = {}
+            count = 0
+            deadline = time.time() + flush_interval
+            while count < batch_size:
+                try:
+                    item = queue.get(timeout=max(deadline - time.time(), 0.001))
+                except Empty:
+                    break
+                count += 1
+                if item is None:
+                    stop = True
+                    break
+                dbname, kind, row = item
+                if kind == 'progress':
+                    # Older states of the same pid are obsolete
+                    progress_by_dbname.setdefault(dbname, {})[row[0]] = row
+                else:
+                    rows_by_dbname.setdefault(dbname, []).append(row)
+            for dbname, rows in rows_by_dbname.iteritems():
+                try:
+                    self._insert(dbname, rows)
+                except Exception, e:
+                    sys.stderr.write('Insertion of %s logs in %s failed: %s\n' % (len(rows), dbname, e))
+            for dbname, rows_by_pid in progress_by_dbname.iteritems():
+                try:
+                    self._upsert_progress(dbname, rows_by_pid.values())
+                except Exception, e:
+                    sys.stderr.write('Update of %s progress in %s failed: %s\n' % (len(rows_by_pid), dbname, e))
+            for _index in xrange(count):
+                queue.task_done()
+
+    def _insert(self, dbname, rows):
+        request = """INSERT INTO smile_log (log_date, log_uid, model_name, res_id, pid, level, message,
+        duration, exception_type, stack)
+        VALUES %s""" % ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+        params = [param for row in rows for param in row]
+        self._execute(dbname, request, params)
+
+    def _upsert_progress(self, dbname, rows):
+        request = """INSERT INTO smile_log_progress (pid, log_uid, model_name, res_id, start_date, update_date,
+        done, total, progress, rate, eta)
+        VALUES %s
+        ON CONFLICT (pid) DO UPDATE SET update_date = EXCLUDED.update_date, done = EXCLUDED.done,
+        total = EXCLUDED.total, progress = EXCLUDED.progress, rate = EXCLUDED.rate, eta = EXCLUDED.eta
+        """ % ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(rows))
+        params = [param for row in rows for param in row]
+        self._execute(dbname, request, params)
+
+    def _execute(self, dbname, request, params):
         try:
-            cr.execute(request, params)
-        except:
-            # retry
-            cr = self._get_cursor(dbname)
-            cr.execute(request, params)
-        return True
+            with self._get_pool(dbname).cursor() as cr:
+                cr.execute(request, params)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # retry once with another connection, broken ones being discarded
+            with self._get_pool(dbname).cursor() as cr:
+                cr.execute(request, params)
+
+    def flush(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.join()
 
     def close(self):
         logging.Handler.close(self)
-        for cr in self._dbname_to_cr.values():
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        for pool in self._dbname_to_pool.values():
             try:
-                cr.execute("INSERT INTO smile_log (log_date, log_uid, model_name, res_id, pid, level, message) "
-                           "VALUES (now() at time zone 'UTC', 0, '', 0, 0, 'INFO', 'OpenERP server stopped')")
+                with pool.cursor() as cr:
+                    cr.execute("INSERT INTO smile_log (log_date, log_uid, model_name, res_id, pid, level, message) "
+                               "VALUES (now() at time zone 'UTC', 0, '', 0, 0, 'INFO', 'OpenERP server stopped')")
             finally:
-                cr.close()
-        self._dbname_to_cr = {}
+                pool.close()
+        self._dbname_to_pool = {}
 
-logging.getLogger('smile_log').addHandler(SmileDBHandler())
+smile_db_handler = SmileDBHandler()
+logging.getLogger('smile_log').addHandler(smile_db_handler)
@@ -19,37 +19,49 @@
 #
 ##############################################################################
 
+from collections import deque
 import datetime
 import logging
+import os
+import threading
+import time
 
-from odoo.modules.registry import RegistryManager
+from odoo.sql_db import db_connect
+from odoo.tools import config
 
+from .db_handler import smile_db_handler
 from .misc import add_timing, add_trace
 
+_pids = {}
+_pids_lock = threading.Lock()
+
+
+def get_pid(dbname):
+    """Return a new logger pid, taken from a block of pids fetched at once from smile_log_seq"""
+    with _pids_lock:
+        # Blocks are not shared between forked processes
+        pids = _pids.setdefault((os.getpid(), dbname), deque())
+        if not pids:
+            block_size = int(config.get('smile_log_pid_block_size', 100))
+            cr = db_connect(dbname).cursor()
+            try:
+                cr.execute("SELECT nextval('smile_log_seq') FROM generate_series(1, %s)", (block_size,))
+                pids.extend(res[0] for res in cr.fetchall())
+            finally:
+                cr.close()
+        return pids.popleft()
+
 
 class SmileDBLogger:
 
     def __init__(self, dbname, model_name, res_id, uid=0):
         assert isinstance(uid, (int, long)), 'uid should be an integer'
         self._logger = logging.getLogger('smile_log')
-
-        db = RegistryManager.get(dbname)._db
-        pid = 0
-
-        try:
-            cr = db.cursor()
-            cr.autocommit(True)
-            cr.execute("select relname from pg_class where relname='smile_log_seq'")
-            if not cr.rowcount:
-                cr.execute("create sequence smile_log_seq")
-            cr.execute("select nextval('smile_log_seq')")
-            res = cr.fetchone()
-            pid = res and res[0] or 0
-        finally:
-            cr.close()
-
+        pid = get_pid(dbname)
         self._logger_start = datetime.datetime.now()
         self._logger_args = {'dbname': dbname, 'model_name': model_name, 'res_id': res_id, 'uid': uid, 'pid': pid}
+        self._progress_interval = float(config.get('smile_log_progress_interval', 1.0))
+        self._progress_last_update = 0.0
 
     @property
     def pid(self):
@@ -73,22 +85,47 @@ class SmileDBLogger:
     def log(self, msg):
         self._logger.log(msg, self._logger_args)
 
-    @add_trace
-    def error(self, msg):
-        self._logger.error(msg, self._logger_args)
-
-    @add_trace
-    def critical(self, msg):
-        self._logger.critical(msg, self._logger_args)
-
-    @add_trace
-    def exception(self, msg):
-        self._logger.exception(msg, self._logger_args)
-
-    @add_timing
-    def time_info(self, msg):
-        self._logger.info(msg, self._logger_args)
-
-    @add_timing
-    def time_debug(self, msg):
-        self._logger.debug(msg, self._logger_args)
+    @add_trace(logging.ERROR)
+    def error(self, msg, **extra):
+        self._logger.error(msg, dict(self._logger_args, **extra))
+
+    @add_trace(logging.CRITICAL)
+    def critical(self, msg, **extra):
+        self._logger.critical(msg, dict(self._logger_args, **extra))
+
+    @add_trace(logging.ERROR)
+    def exception(self, msg, **extra):
+        self._logger.exception(msg, dict(self._logger_args, **extra))
+
+    @add_timing(logging.INFO)
+    def time_info(self, msg, **extra):
+        self._logger.info(msg, dict(self._logger_args, **extra))
+
+    @add_timing(logging.DEBUG)
+    def time_debug(self, msg, **extra):
+        self._logger.debug(msg, dict(self._logger_args, **extra))
+
+    def progress(self, done, total=None):
+        """Store progress of the process in its smile_log_progress row, without adding a log
+
+        Rate (items per second) and ETA are computed since logger creation.
+        Updates are ignored if the previous one is more recent than
+        smile_log_progress_interval seconds (default: 1), except the last one.
+        """
+        now = time.time()
+        if done != total and now - self._progress_last_update < self._progress_interval:
+            return
+        self._progress_last_update = now
+        elapsed = (datetime.datetime.now() - self._logger_start).total_seconds()
+        update_date = datetime.datetime.utcnow()
+        rate = done / elapsed if elapsed > 0 else 0.0
+        progress = eta = None
+        if total:
+            progress = min(100.0 * done / total, 100.0)
+            if rate:
+                eta = update_date + datetime.timedelta(seconds=max(total - done, 0) / rate)
+        args = self._logger_args
+        smile_db_handler.progress(args['dbname'], (
+            args['pid'], args['uid'], args['model_name'], args['res_id'],
+            update_date - datetime.timedelta(seconds=elapsed), update_date,
+            done, total, progress, rate, eta))
@@ -20,21 +20,36 @@
 ##############################################################################
 
 import datetime
+import sys
 import traceback
 
 
-def add_timing(original_method):
-    def new_method(self, msg):
-        delay = datetime.datetime.now() - self._logger_start
-        msg += " after %sh %smin %ss" % tuple(str(delay).split(':'))
-        return original_method(self, msg)
-    return new_method
+def add_timing(level):
+    """Pass the duration in milliseconds since logger creation,
+    only if level is enabled
+    """
+    def decorator(original_method):
+        def new_method(self, msg):
+            if not self._logger.isEnabledFor(level):
+                return
+            delay = datetime.datetime.now() - self._logger_start
+            return original_method(self, msg, duration=delay.total_seconds() * 1000.0)
+        return new_method
+    return decorator
 
 
-def add_trace(original_method):
-    def new_method(self, msg):
-        stack = traceback.format_exc()
-        stack = stack.replace('%', '%%')
-        msg += '\n%s' % stack.decode('utf-8')
-        return original_method(self, msg)
-    return new_method
+def add_trace(level):
+    """Pass the class and the stack of the exception being handled,
+    only if level is enabled
+    """
+    def decorator(original_method):
+        def new_method(self, msg):
+            if not self._logger.isEnabledFor(level):
+                return
+            exc_type = sys.exc_info()[0]
+            if not exc_type:
+                return original_method(self, msg)
+            stack = traceback.format_exc().decode('utf-8')
+            return original_method(self, msg, exception_type=exc_type.__name__, stack=stack)
+        return new_method
+    return decorator